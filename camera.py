@@ -0,0 +1,652 @@
+import cv2
+import math
+import numpy as np
+import sys
+import threading
+import time
+from jpegEncoder import create_encoder
+
+# How long get_frame() waits for a fresh frame when the latest grab was not retrieved
+FRESH_FRAME_TIMEOUT = 0.5
+
+
+def is_jpeg(frame):
+    """True for the raw buffer OpenCV returns for MJPEG capture with CAP_PROP_CONVERT_RGB off"""
+    return frame.ndim == 1 or (frame.ndim == 2 and frame.shape[0] == 1)
+
+
+def decode_jpeg(jpeg, flags=cv2.IMREAD_COLOR):
+    """Decode JPEG bytes; IMREAD_REDUCED_* flags decode at 1/2, 1/4 or 1/8 size for much less work"""
+    return cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), flags)
+
+
+def reduced_decode_flag(frame_width, width):
+    """Largest IMREAD_REDUCED_COLOR_* scale that still decodes at least `width` pixels wide"""
+    for scale, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                        (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if frame_width // scale >= width:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def read_only(frame):
+    """Read-only view of a frame, holding a reference to its buffer instead of copying it"""
+    if frame is None:
+        return None
+    view = frame.view()
+    view.flags.writeable = False
+    return view
+
+
+class FrameRing:
+    """Fixed-size ring of the most recent frames with their capture times
+
+    All buffers are allocated up front; the capture thread decodes straight
+    into the next slot so steady-state capture does not allocate. With shape
+    None the ring holds the camera's JPEG bytes instead of pixels.
+
+    Readers get read_only() views, which keep a reference to the slot's buffer.
+    A slot whose buffer is still referenced is never written again: it gets a
+    retired buffer nobody holds any more, or a new one, instead.
+    """
+
+    def __init__(self, capacity, shape, dtype=np.uint8):
+        self.capacity = capacity
+        self.compressed = shape is None
+        self.shape = shape
+        self.dtype = dtype
+        if self.compressed:
+            self.frames = [None] * capacity
+        else:
+            self.frames = [np.empty(shape, dtype=dtype) for _ in range(capacity)]
+        self.retired = []  # Buffers swapped out of the ring while readers held them
+        self.buffers_allocated = 0  # Extra buffers allocated because all were in use
+        self.timestamps = np.full(capacity, -np.inf)  # time.monotonic() at capture, -inf if empty
+        self.sequences = np.zeros(capacity, dtype=np.int64)
+        self.sharpness = np.zeros(capacity)
+        self.motion = np.zeros(capacity)
+        self.scores = np.zeros(capacity)
+        self.next_slot = 0
+
+    def claim_slot(self):
+        """Return the slot the next frame is written to and mark it invalid until committed"""
+        slot = self.next_slot
+        self.timestamps[slot] = -np.inf
+        # References from the list and the getrefcount argument, anything more is a reader
+        if not self.compressed and sys.getrefcount(self.frames[slot]) > 2:
+            self.retired.append(self.frames[slot])
+            self.frames[slot] = self._free_buffer()
+        return slot
+
+    def _free_buffer(self):
+        for index in range(len(self.retired)):
+            # References from the retired list and the getrefcount argument
+            if sys.getrefcount(self.retired[index]) <= 2:
+                return self.retired.pop(index)
+        if len(self.retired) > self.capacity:
+            self.retired.pop(0)  # Freed once its readers let go
+        self.buffers_allocated += 1
+        return np.empty(self.shape, dtype=self.dtype)
+
+    def commit(self, slot, timestamp, sequence, scores=None):
+        self.timestamps[slot] = timestamp
+        self.sequences[slot] = sequence
+        if scores is not None:
+            self.sharpness[slot], self.motion[slot], self.scores[slot] = scores
+        self.next_slot = (slot + 1) % self.capacity
+
+    def slots_between(self, start, end):
+        """Slots captured in [start, end], oldest first"""
+        slots = np.nonzero((self.timestamps >= start) & (self.timestamps <= end))[0]
+        return slots[np.argsort(self.timestamps[slots])]
+
+
+class FrameScorer:
+    """Cheap per-frame quality score for picking the frame to send on a trigger
+
+    Works on a small grayscale copy. Sharpness is the variance of the Laplacian
+    (blurred plates score low) and motion is the mean absolute difference from the
+    previous frame (a vehicle still moving scores high). The combined score
+    favours sharp, still frames. All work buffers are allocated once.
+    """
+
+    def __init__(self, width=320, motion_weight=0.1):
+        self.width = width
+        self.motion_weight = motion_weight
+        self._source_shape = None
+        self._size = None
+        self._small = None
+        self._gray = None
+        self._previous = None
+        self._laplacian = None
+        self._diff = None
+
+    def _allocate(self, frame):
+        self._source_shape = frame.shape
+        height = max(1, round(frame.shape[0] * self.width / frame.shape[1]))
+        self._size = (self.width, height)
+        self._small = np.empty((height, self.width) + frame.shape[2:], dtype=frame.dtype)
+        self._gray = np.empty((height, self.width), dtype=np.uint8)
+        self._previous = None
+        self._laplacian = np.empty((height, self.width), dtype=np.float32)
+        self._diff = np.empty((height, self.width), dtype=np.uint8)
+
+    def score(self, frame):
+        """Returns (sharpness, motion, score)"""
+        if frame.shape != self._source_shape:
+            self._allocate(frame)
+        cv2.resize(frame, self._size, dst=self._small, interpolation=cv2.INTER_AREA)
+        if self._small.ndim == 3:
+            cv2.cvtColor(self._small, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        else:
+            self._gray[...] = self._small
+
+        cv2.Laplacian(self._gray, cv2.CV_32F, dst=self._laplacian)
+        sharpness = float(cv2.meanStdDev(self._laplacian)[1][0, 0] ** 2)
+
+        if self._previous is None:
+            self._previous = np.empty_like(self._gray)
+            motion = 0.0
+        else:
+            cv2.absdiff(self._gray, self._previous, dst=self._diff)
+            motion = cv2.mean(self._diff)[0]
+        self._gray, self._previous = self._previous, self._gray
+
+        return sharpness, motion, sharpness / (1.0 + self.motion_weight * motion)
+
+
+# Camera handling class
+class CameraHandler:
+    def __init__(self, source=0, width=1920, height=1080, buffer_seconds=0, scorer=None, encoder=None,
+                 mjpeg=False):
+        """With buffer_seconds set, the last few seconds of frames are kept for get_frames()
+
+        With a FrameScorer, every captured frame is scored and get_best_frame() picks
+        the best buffered one. encoder (see jpegEncoder) is used for get_jpeg_frame().
+
+        With mjpeg the camera is asked for MJPG and its compressed frames are kept
+        as they are: streaming and uploads use them directly and they are only decoded
+        when pixels are asked for. Scoring decodes a reduced grayscale image. If the
+        camera ignores the request, capture falls back to decoded frames.
+        """
+        self.source = source
+        self.mjpeg = mjpeg
+        self.encoder = encoder or create_encoder()
+        self.frame_jpeg = None  # Camera's JPEG bytes of the latest frame in MJPEG mode
+        self.width = width
+        self.height = height
+        self.buffer_seconds = buffer_seconds
+        self.scorer = scorer
+        self.frame_scores = None  # (sharpness, motion, score) of self.frame
+        self.ring = None
+        self.camera = None
+        self.frame = None
+        self.frame_time = None  # time.monotonic() when self.frame was captured
+        self.frame_sequence = 0  # grab_sequence of self.frame
+        self.grab_time = None  # time.monotonic() of the latest grab, retrieved or not
+        self.grab_sequence = 0  # Incremented for every frame grabbed from the camera
+        self._waiting = 0  # Threads waiting for pixels, frames are only retrieved for them
+        self.bad_frames = 0  # Camera JPEGs that failed to decode and were skipped
+        self.capture_errors = 0
+        self.lock = threading.Lock()
+        self.frame_condition = threading.Condition(self.lock)
+        self.running = False
+
+    def initialize(self):
+        if self.camera is None:
+            self.camera = cv2.VideoCapture(self.source)
+            if self.mjpeg:
+                self.camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+                self.camera.set(cv2.CAP_PROP_CONVERT_RGB, 0)  # Hand back the compressed bytes
+            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+            # Keep the driver from queueing old frames, not every backend supports it
+            self.camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            self.running = True
+            # Start frame capture thread
+            threading.Thread(target=self._capture_frames, daemon=True).start()
+
+    def _capture_frames(self):
+        while self.running:
+            camera = self.camera  # release() may clear self.camera while grab() blocks
+            if camera is None:
+                time.sleep(0.1)
+                continue
+            try:
+                self._capture_frame(camera)
+            except Exception as e:  # One bad frame must not stop capture
+                self.capture_errors += 1
+                print(f"Error capturing from camera {self.source}: {e}")
+                time.sleep(0.1)
+
+    def _capture_frame(self, camera):
+        # grab() blocks until the camera delivers the next frame, which paces the loop
+        if not camera.grab():
+            time.sleep(0.1)  # Camera unplugged or stream ended
+            return
+        timestamp = time.monotonic()
+        with self.lock:
+            self.grab_sequence += 1
+            self.grab_time = timestamp
+            # Buffering and scoring need every frame, otherwise only retrieve while someone waits
+            wanted = self.buffer_seconds or self.scorer is not None or self._waiting
+        if not wanted:
+            return
+
+        if self.ring is None or self.ring.compressed:
+            success, frame = camera.retrieve()
+            if success and is_jpeg(frame):
+                if self.buffer_seconds and self.ring is None:
+                    self._allocate_ring(None)
+                self._publish_jpeg(frame.tobytes(), timestamp)
+            elif success:
+                self._publish(frame, timestamp)
+                self._allocate_ring(frame)  # Decoded frames always go through ring buffers
+        else:
+            with self.lock:
+                slot = self.ring.claim_slot()
+            target = self.ring.frames[slot]
+            success, frame = camera.retrieve(target)
+            if success:
+                if frame.shape != target.shape or frame.dtype != target.dtype:
+                    # Resolution changed, reallocate and keep going
+                    self._allocate_ring(frame)
+                    slot = self.ring.claim_slot()
+                    target = self.ring.frames[slot]
+                if frame.ctypes.data != target.ctypes.data:
+                    np.copyto(target, frame)
+                self._publish(target, timestamp, slot)
+
+    def _allocate_ring(self, frame):
+        fps = self.camera.get(cv2.CAP_PROP_FPS) or 30
+        # At least triple buffered: one being written, the latest, and one still being read
+        capacity = max(3, math.ceil(self.buffer_seconds * fps))
+        with self.lock:
+            if frame is None:
+                self.ring = FrameRing(capacity, None)
+            else:
+                self.ring = FrameRing(capacity, frame.shape, frame.dtype)
+
+    def _publish_jpeg(self, jpeg, timestamp):
+        scores = None
+        if self.scorer is not None:
+            gray = decode_jpeg(jpeg, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+            if gray is None:
+                self.bad_frames += 1  # Corrupt or truncated, keep the last good frame as the latest
+                return
+            scores = self.scorer.score(gray)
+        slot = None
+        if self.ring is not None:
+            with self.lock:
+                slot = self.ring.claim_slot()
+                self.ring.frames[slot] = jpeg
+        self._publish(None, timestamp, slot, scores, jpeg)
+
+    def _publish(self, frame, timestamp, slot=None, scores=None, jpeg=None):
+        if frame is not None and self.scorer is not None:
+            scores = self.scorer.score(frame)
+        with self.frame_condition:
+            self.frame = frame  # None until decoded in MJPEG mode
+            self.frame_jpeg = jpeg
+            self.frame_time = timestamp
+            self.frame_scores = scores
+            self.frame_sequence = self.grab_sequence
+            if slot is not None:
+                self.ring.commit(slot, timestamp, self.frame_sequence, scores)
+            self.frame_condition.notify_all()
+
+    def get_frames(self, start, end):
+        """Read-only views of the buffered frames captured between two time.monotonic() values
+
+        Returns a list of (timestamp, sequence, frame), oldest first. Only the last
+        few frames are kept when buffering is off.
+        """
+        with self.lock:
+            if self.ring is None:
+                return []
+            frames = [(float(self.ring.timestamps[slot]), int(self.ring.sequences[slot]),
+                       self.ring.frames[slot] if self.ring.compressed else read_only(self.ring.frames[slot]))
+                      for slot in self.ring.slots_between(start, end)]
+        if self.ring.compressed:
+            frames = [(timestamp, sequence, read_only(decode_jpeg(jpeg)))
+                      for timestamp, sequence, jpeg in frames]
+        return frames
+
+    def get_frames_around(self, timestamp, before=0.5, after=0.5):
+        return self.get_frames(timestamp - before, timestamp + after)
+
+    def _best(self, start, end):
+        # (timestamp, sequence, frame or JPEG bytes, scores) of the best buffered frame
+        with self.lock:
+            if self.ring is not None and self.scorer is not None:
+                slots = self.ring.slots_between(start, end)
+                if len(slots):
+                    slot = slots[np.argmax(self.ring.scores[slots])]
+                    frame = self.ring.frames[slot]
+                    return (float(self.ring.timestamps[slot]), int(self.ring.sequences[slot]),
+                            frame if self.ring.compressed else read_only(frame),
+                            (float(self.ring.sharpness[slot]), float(self.ring.motion[slot]),
+                             float(self.ring.scores[slot])))
+        frame_time, sequence, frame, jpeg, scores = self._latest()
+        if jpeg is not None:
+            return frame_time, sequence, jpeg, scores
+        if frame is None:
+            return None
+        return frame_time, sequence, frame, scores
+
+    def get_best_frame(self, start, end):
+        """Read-only view of the best scoring buffered frame captured between start and end
+
+        Returns (timestamp, sequence, frame, (sharpness, motion, score)), falling
+        back to the latest frame when nothing is buffered in the window.
+        """
+        best = self._best(start, end)
+        if best is not None and isinstance(best[2], bytes):
+            best = best[:2] + (read_only(decode_jpeg(best[2])),) + best[3:]
+        return best
+
+    def get_best_jpeg(self, start, end):
+        """Like get_best_frame() but returns JPEG bytes, the camera's own in MJPEG mode"""
+        best = self._best(start, end)
+        if best is not None and not isinstance(best[2], bytes):
+            best = best[:2] + (self.encoder.encode(best[2]),) + best[3:]
+        return best
+
+    def get_scores(self, start, end):
+        """(timestamp, sequence, sharpness, motion, score) of buffered frames, for tuning"""
+        with self.lock:
+            if self.ring is None:
+                return []
+            return [(float(self.ring.timestamps[slot]), int(self.ring.sequences[slot]),
+                     float(self.ring.sharpness[slot]), float(self.ring.motion[slot]),
+                     float(self.ring.scores[slot]))
+                    for slot in self.ring.slots_between(start, end)]
+
+    def _decoded(self, frame, jpeg, sequence):
+        # Decode an MJPEG frame once and keep it while it is still the latest
+        if frame is None and jpeg is not None:
+            frame = read_only(decode_jpeg(jpeg))
+            with self.lock:
+                if self.frame_sequence == sequence:
+                    self.frame = frame
+        return frame
+
+    def _latest(self):
+        # (timestamp, sequence, frame view, jpeg, scores) of the latest grab, waiting for
+        # the next frame when the latest grab was skipped because nobody needed its pixels
+        with self.frame_condition:
+            stale = self.frame_sequence < self.grab_sequence
+            if stale:
+                self._waiting += 1
+                try:
+                    self.frame_condition.wait_for(
+                        lambda: self.frame_sequence >= self.grab_sequence or not self.running,
+                        FRESH_FRAME_TIMEOUT)
+                finally:
+                    self._waiting -= 1
+            return (self.frame_time, self.frame_sequence, read_only(self.frame), self.frame_jpeg,
+                    self.frame_scores)
+
+    def get_frame(self):
+        """Read-only view of the latest frame, use .copy() to modify it
+
+        The capture thread never writes into a buffer that is still referenced, so
+        the view stays stable for as long as it is held.
+        """
+        _, sequence, frame, jpeg, _ = self._latest()
+        if frame is None and jpeg is not None:
+            frame = self._decoded(frame, jpeg, sequence)
+        return frame
+
+    def get_frame_after(self, timestamp, timeout=1.0):
+        """First frame captured after time.monotonic() `timestamp`, waiting up to `timeout`
+
+        Returns (capture time, sequence, read-only frame) or None if no frame arrives in time.
+        """
+        with self.lock:
+            if self.ring is not None:
+                slots = self.ring.slots_between(timestamp, np.inf)
+                slots = slots[self.ring.timestamps[slots] > timestamp]
+                if len(slots):
+                    slot = slots[0]
+                    frame = self.ring.frames[slot]
+                    captured = (float(self.ring.timestamps[slot]), int(self.ring.sequences[slot]),
+                                frame if self.ring.compressed else read_only(frame))
+                    if self.ring.compressed:
+                        return captured[:2] + (read_only(decode_jpeg(frame)),)
+                    return captured
+
+        with self.frame_condition:
+            self._waiting += 1
+            try:
+                self.frame_condition.wait_for(
+                    lambda: (self.frame_time is not None and self.frame_time > timestamp) or not self.running,
+                    timeout)
+            finally:
+                self._waiting -= 1
+            if self.frame_time is None or self.frame_time <= timestamp:
+                return None
+            frame = read_only(self.frame)
+            captured = self.frame_time, self.frame_jpeg, self.frame_sequence
+        frame_time, jpeg, sequence = captured
+        if frame is None:
+            frame = self._decoded(None, jpeg, sequence)
+        return frame_time, sequence, frame
+
+    def wait_for_capture(self, after_sequence=0, timeout=None):
+        """Wait for a frame newer than `after_sequence`, returns (frame, jpeg, sequence)
+
+        In MJPEG mode frame is None unless already decoded and jpeg holds the
+        camera's bytes; otherwise jpeg is None. Returns (None, None, after_sequence)
+        on timeout.
+        """
+        with self.frame_condition:
+            self._waiting += 1
+            try:
+                if not self.frame_condition.wait_for(
+                        lambda: self.frame_sequence > after_sequence or not self.running, timeout):
+                    return None, None, after_sequence
+            finally:
+                self._waiting -= 1
+            return read_only(self.frame), self.frame_jpeg, self.frame_sequence
+
+    def wait_for_frame(self, after_sequence=0, timeout=None):
+        """Wait for a frame newer than `after_sequence`, returns (frame, sequence)
+
+        The frame is a read-only view, not a copy. Returns (None, after_sequence)
+        on timeout.
+        """
+        frame, jpeg, sequence = self.wait_for_capture(after_sequence, timeout)
+        return self._decoded(frame, jpeg, sequence), sequence
+
+    def get_jpeg_frame(self):
+        _, _, frame, jpeg, _ = self._latest()
+        if jpeg is not None:
+            return jpeg
+        if frame is not None:
+            return self.encoder.encode(frame)
+        return None
+
+    def release(self):
+        self.running = False
+        with self.frame_condition:
+            self.frame_condition.notify_all()
+        if self.camera is not None:
+            self.camera.release()
+            self.camera = None
+
+
+class FrameBroadcaster:
+    """Encode each captured frame once and share the JPEG with every viewer
+
+    Viewers always get the newest encoded frame; a slow viewer skips frames
+    instead of holding up capture or the other viewers. Nothing is encoded
+    while nobody is watching.
+
+    width, fps and quality configure the stream, e.g. a small, low-rate preview
+    for the dashboard while full-resolution frames are kept for trigger snapshots.
+    None keeps the camera's resolution or frame rate. encoder overrides quality
+    with a specific jpegEncoder backend.
+
+    With an MJPEG camera and no width the camera's JPEGs are passed through
+    untouched; with a width they are decoded at reduced scale before resizing.
+    """
+
+    def __init__(self, camera_handler, width=None, fps=None, quality=95, encoder=None):
+        self.camera_handler = camera_handler
+        self.width = width
+        self.fps = fps
+        self.encoder = encoder or create_encoder(quality=quality)
+        self._resized = None
+        self.jpeg = None
+        self.sequence = 0
+        self.subscribers = 0
+        self.frames_encoded = 0
+        self.bad_frames = 0  # Camera JPEGs that failed to decode and were skipped
+        self.condition = threading.Condition()
+        self.running = False
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            threading.Thread(target=self._encode_frames, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+
+    def _resize(self, frame):
+        if self.width is None or frame.shape[1] <= self.width:
+            return frame
+        height = round(frame.shape[0] * self.width / frame.shape[1])
+        shape = (height, self.width) + frame.shape[2:]
+        if self._resized is None or self._resized.shape != shape:
+            self._resized = np.empty(shape, dtype=frame.dtype)
+        cv2.resize(frame, (self.width, height), dst=self._resized, interpolation=cv2.INTER_AREA)
+        return self._resized
+
+    def _encode_frames(self):
+        frame_sequence = 0
+        next_frame_time = 0.0
+        while self.running:
+            with self.condition:
+                self.condition.wait_for(lambda: self.subscribers > 0 or not self.running)
+            if self.fps:
+                delay = next_frame_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_frame_time = max(next_frame_time, time.monotonic() - 1.0 / self.fps) + 1.0 / self.fps
+            try:
+                frame_sequence = self._encode_frame(frame_sequence)
+            except Exception as e:  # One bad frame must not stop the preview
+                print(f"Error encoding preview frame: {e}")
+                time.sleep(0.1)
+
+    def _encode_frame(self, frame_sequence):
+        # Encode and publish the next capture after frame_sequence, returns its sequence
+        frame, jpeg, frame_sequence = self.camera_handler.wait_for_capture(frame_sequence, timeout=1.0)
+        if frame is None and jpeg is None:
+            return frame_sequence
+        if jpeg is None or self.width is not None:  # Otherwise the camera's JPEG goes out as is
+            if frame is None:
+                frame = decode_jpeg(jpeg, reduced_decode_flag(self.camera_handler.width, self.width))
+                if frame is None:
+                    self.bad_frames += 1  # Corrupt or truncated, wait for the next one
+                    return frame_sequence
+            jpeg = self.encoder.encode(self._resize(frame))
+            if jpeg is None:
+                return frame_sequence
+        with self.condition:
+            self.jpeg = jpeg
+            self.sequence += 1
+            self.frames_encoded += 1
+            self.condition.notify_all()
+        return frame_sequence
+
+    def wait_for_jpeg(self, after_sequence=0, timeout=None):
+        """Wait for a JPEG newer than `after_sequence`, returns (jpeg, sequence)"""
+        with self.condition:
+            if not self.condition.wait_for(
+                    lambda: self.sequence > after_sequence or not self.running, timeout):
+                return None, after_sequence
+            return self.jpeg, self.sequence
+
+    def subscribe(self):
+        """Count a viewer, frames are only encoded while there is one"""
+        with self.condition:
+            self.subscribers += 1
+            self.condition.notify_all()
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+
+    def generate_frames(self):
+        """Generate multipart frames for one /video_feed client"""
+        self.subscribe()
+        try:
+            sequence = 0
+            while self.running:
+                jpeg, sequence = self.wait_for_jpeg(sequence, timeout=1.0)
+                if jpeg is not None:
+                    yield (b'--frame\r\n'
+                           b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+        finally:
+            self.unsubscribe()
+
+
+class CameraManager:
+    """Run several cameras in one process, one capture thread each, grouped by lane
+
+    Cameras are keyed by an id such as 'lane1' or 'lane1-rear'. Cameras added with
+    the same lane are the views of that lane, so a trigger can collect every angle
+    of the same vehicle. Each camera gets its own FrameBroadcaster built with the
+    `preview` keyword arguments; give 'encoder' there as create_encoder() keywords
+    so every broadcaster gets its own encoder instead of sharing (and locking) one.
+    """
+
+    def __init__(self, preview=None):
+        self.preview = preview or {}
+        self.cameras = {}  # camera id -> CameraHandler
+        self.broadcasters = {}  # camera id -> FrameBroadcaster
+        self.lanes = {}  # lane -> [camera id], in the order added
+
+    def add(self, camera_id, camera_handler, lane=None, broadcaster=None):
+        """broadcaster replaces the default preview FrameBroadcaster, e.g. a CaptureProcess"""
+        lane = camera_id if lane is None else lane
+        self.cameras[camera_id] = camera_handler
+        if broadcaster is None:
+            options = dict(self.preview)
+            if isinstance(options.get('encoder'), dict):
+                options['encoder'] = create_encoder(**options['encoder'])
+            broadcaster = FrameBroadcaster(camera_handler, **options)
+        self.broadcasters[camera_id] = broadcaster
+        self.lanes.setdefault(lane, []).append(camera_id)
+        return camera_handler
+
+    def get(self, camera_id):
+        return self.cameras.get(camera_id)
+
+    def views(self, lane):
+        """[(camera id, CameraHandler)] of every camera on a lane, empty for an unknown lane"""
+        return [(camera_id, self.cameras[camera_id]) for camera_id in self.lanes.get(lane, [])]
+
+    def get_best_jpegs(self, lane, start, end):
+        """get_best_jpeg() of every view of a lane, as [(camera id, best)] with missing views left out"""
+        views = []
+        for camera_id, camera_handler in self.views(lane):
+            best = camera_handler.get_best_jpeg(start, end)
+            if best is not None:
+                views.append((camera_id, best))
+        return views
+
+    def initialize(self):
+        for camera_id, camera_handler in self.cameras.items():
+            camera_handler.initialize()
+            self.broadcasters[camera_id].start()
+
+    def release(self):
+        for camera_id, camera_handler in self.cameras.items():
+            self.broadcasters[camera_id].stop()
+            camera_handler.release()
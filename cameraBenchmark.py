@@ -0,0 +1,71 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+import jpegEncoder
+
+FIXTURES = ('test.jpg', 'images1.jpg')
+RESOLUTIONS = ((640, 360), (1280, 720), (1920, 1080))
+
+
+def load_fixtures(paths=FIXTURES, resolutions=RESOLUTIONS):
+    """Decode the fixture images and scale them to each resolution, returns [(label, frame)]"""
+    frames = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            print(f"Could not read {path}, skipping")
+            continue
+        for width, height in resolutions:
+            frames.append((f"{path} {width}x{height}",
+                           cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)))
+    return frames
+
+
+def benchmark_encoders(backends=None, count=50, streams=4):
+    """Report ms/frame and bytes/frame per JPEG backend and resolution
+
+    Each backend also runs as a ThreadPoolEncoder with `streams` frames in flight,
+    like that many cameras or previews encoding at once; ms/frame there is wall
+    time divided by frames encoded.
+    """
+    if backends is None:
+        backends = {
+            'opencv q95': dict(backend='opencv', quality=95),
+            'opencv q70': dict(backend='opencv', quality=70),
+            'opencv q95 optimize': dict(backend='opencv', quality=95, optimize=True),
+            'turbojpeg q95': dict(backend='turbojpeg', quality=95),
+            'turbojpeg q70': dict(backend='turbojpeg', quality=70),
+        }
+    frames = load_fixtures()
+    print(f"{'backend':<22} {'image':<26} {'ms/frame':>9} {'KB/frame':>9} {'pool ms/frame':>14}")
+    for label, options in backends.items():
+        if options['backend'] not in ('auto', 'opencv'):
+            # Skip instead of silently measuring the OpenCV fallback twice
+            try:
+                jpegEncoder.ENCODERS[options['backend']]()
+            except (ImportError, OSError) as e:
+                print(f"{label:<22} unavailable: {e}")
+                continue
+        encoder = jpegEncoder.create_encoder(**options)
+        pool = jpegEncoder.create_encoder(workers=streams, **options)
+        for name, frame in frames:
+            size = len(encoder.encode(frame))
+
+            start = time.perf_counter()
+            for _ in range(count):
+                encoder.encode(frame)
+            serial_cost = (time.perf_counter() - start) / count * 1000
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=streams) as callers:
+                list(callers.map(lambda _: pool.encode(frame), range(count)))
+            pool_cost = (time.perf_counter() - start) / count * 1000
+
+            print(f"{label:<22} {name:<26} {serial_cost:>9.2f} {size / 1024:>9.1f} {pool_cost:>14.2f}")
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    benchmark_encoders()
@@ -0,0 +1,324 @@
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from camera import CameraHandler, FrameBroadcaster
+from jpegEncoder import create_encoder
+
+POLL_INTERVAL = 0.005  # Seconds between checks for a new shared frame
+
+
+class SharedSlots:
+    """Seqlock-protected slots in shared memory, written by one process and read by others
+
+    Every slot has a header (sequence, count, timestamp, nbytes, shape) next to its
+    data. The writer makes the slot's sequence odd while writing and even again
+    when done, and always writes the slot after the latest one, so readers can
+    use the latest slot in place and check afterwards that it was not overwritten.
+    """
+
+    HEADER = np.dtype([('sequence', '<u8'), ('count', '<i8'), ('timestamp', '<f8'),
+                       ('nbytes', '<u8'), ('shape', '<i8', 3)])
+    # Control words: latest slot, frames published, readers (kept by the reading process)
+    LATEST, PUBLISHED, READERS = range(3)
+
+    def __init__(self, slots, slot_bytes, name=None):
+        """Creates the shared memory when name is None, otherwise attaches to it"""
+        control_bytes = 8 * 4
+        header_bytes = self.HEADER.itemsize * slots
+        create = name is None
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=create, size=control_bytes + header_bytes + slot_bytes * slots)
+        self.name = self.shm.name
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.control = np.ndarray(4, dtype='<i8', buffer=self.shm.buf)
+        self.headers = np.ndarray(slots, dtype=self.HEADER, buffer=self.shm.buf, offset=control_bytes)
+        self.data = np.ndarray((slots, slot_bytes), dtype=np.uint8, buffer=self.shm.buf,
+                               offset=control_bytes + header_bytes)
+        if create:
+            self.control[:] = 0
+            self.control[self.LATEST] = -1
+            self.headers[:] = 0
+
+    @property
+    def published(self):
+        return int(self.control[self.PUBLISHED])
+
+    def write(self, data, timestamp):
+        """Publish a uint8 array or bytes, returns False when it does not fit a slot"""
+        array = data if isinstance(data, np.ndarray) else np.frombuffer(data, dtype=np.uint8)
+        if array.nbytes > self.slot_bytes:
+            return False
+        slot = (int(self.control[self.LATEST]) + 1) % self.slots
+        sequence = int(self.headers['sequence'][slot]) + 1
+        self.headers['sequence'][slot] = sequence  # Odd: being written
+        self.data[slot, :array.nbytes] = array.reshape(-1)
+        count = self.published + 1
+        self.headers['count'][slot] = count
+        self.headers['timestamp'][slot] = timestamp
+        self.headers['nbytes'][slot] = array.nbytes
+        self.headers['shape'][slot] = (array.shape + (0, 0))[:3] if array.ndim > 1 else (array.nbytes, 0, 0)
+        self.headers['sequence'][slot] = sequence + 1
+        self.control[self.LATEST] = slot
+        self.control[self.PUBLISHED] = count
+        return True
+
+    def read(self, copy=True):
+        """Latest entry as (timestamp, count, data, token), or None if nothing is published
+
+        With copy=False data is a view into shared memory; it stays valid while
+        valid(token) is True, i.e. until the writer comes back around to its slot.
+        """
+        for _ in range(self.slots * 2):
+            slot = int(self.control[self.LATEST])
+            if slot < 0:
+                return None
+            sequence = int(self.headers['sequence'][slot])
+            if sequence & 1:
+                continue
+            header = self.headers[slot].copy()
+            shape = tuple(int(size) for size in header['shape'] if size)
+            data = self.data[slot, :int(header['nbytes'])].reshape(shape)
+            if copy:
+                data = data.copy()
+            token = (slot, sequence)
+            if self.valid(token):
+                return float(header['timestamp']), int(header['count']), data, token
+        return None
+
+    def valid(self, token):
+        slot, sequence = token
+        return int(self.headers['sequence'][slot]) == sequence
+
+    def wait(self, after_count=0, timeout=None):
+        """Wait until more than `after_count` entries were published, returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.published <= after_count:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    def close(self, unlink=False):
+        # The numpy views hold exported pointers into the buffer, drop them first
+        del self.control, self.headers, self.data
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _encoder_options(options):
+    # Encoders hold library handles and are built inside the worker from create_encoder() keywords
+    options = dict(options or {})
+    if isinstance(options.get('encoder'), dict):
+        options['encoder'] = create_encoder(**options['encoder'])
+    return options
+
+
+def _publish_previews(broadcaster, jpegs, running):
+    subscribed = False
+    sequence = 0
+    while running.is_set():
+        readers = int(jpegs.control[SharedSlots.READERS])
+        if readers > 0 and not subscribed:
+            broadcaster.subscribe()
+            subscribed = True
+        elif readers <= 0 and subscribed:
+            broadcaster.unsubscribe()
+            subscribed = False
+        if not subscribed:
+            time.sleep(0.05)
+            continue
+        jpeg, sequence = broadcaster.wait_for_jpeg(sequence, timeout=0.1)
+        if jpeg is not None and not jpegs.write(jpeg, time.monotonic()):
+            print(f"Preview JPEG of {len(jpeg)} bytes does not fit a shared slot")
+
+
+def _publish_frames(camera_handler, frames, running):
+    sequence = 0
+    while running.is_set():
+        frame, sequence = camera_handler.wait_for_frame(sequence, timeout=0.1)
+        if frame is not None and not frames.write(frame, camera_handler.frame_time):
+            print(f"Frame of shape {frame.shape} does not fit a shared slot")
+
+
+def _worker_main(camera_options, preview_options, frame_slots, jpeg_slots, connection):
+    """Capture process: runs the camera, publishes frames and previews, answers commands"""
+    camera_handler = CameraHandler(**_encoder_options(camera_options))
+    broadcaster = FrameBroadcaster(camera_handler, **_encoder_options(preview_options))
+    jpegs = SharedSlots(*jpeg_slots)
+    frames = SharedSlots(*frame_slots) if frame_slots else None
+    running = threading.Event()
+    running.set()
+    camera_handler.initialize()
+    broadcaster.start()
+    threading.Thread(target=_publish_previews, args=(broadcaster, jpegs, running), daemon=True).start()
+    if frames is not None:
+        threading.Thread(target=_publish_frames, args=(camera_handler, frames, running), daemon=True).start()
+
+    commands = {
+        'get_best_jpeg': camera_handler.get_best_jpeg,
+        'get_scores': camera_handler.get_scores,
+        'get_jpeg_frame': camera_handler.get_jpeg_frame,
+        'get_frame_after': camera_handler.get_frame_after,
+    }
+    try:
+        while True:
+            try:
+                name, args = connection.recv()
+            except EOFError:
+                break  # Parent went away
+            if name == 'stop':
+                break
+            try:
+                result = commands[name](*args)
+            except Exception as e:
+                print(f"Capture process command {name} failed: {e}")
+                result = None
+            connection.send(result)
+    finally:
+        running.clear()
+        broadcaster.stop()
+        camera_handler.release()
+        time.sleep(0.2)  # Let the publisher threads see running cleared
+        jpegs.close()
+        if frames is not None:
+            frames.close()
+        connection.close()
+
+
+class CaptureProcess:
+    """Run capture, scoring and preview encoding for one camera in a worker process
+
+    The Flask process no longer shares a GIL with capture and encoding. Preview
+    JPEGs, and with share_frames the decoded frames, are published through
+    SharedSlots and mapped here without pickling. Trigger queries such as
+    get_best_jpeg() go over a pipe.
+
+    camera_options and preview_options are CameraHandler and FrameBroadcaster
+    keywords, with 'encoder' given as create_encoder() keywords. The object has the
+    CameraHandler calls the trigger server uses and FrameBroadcaster's
+    generate_frames(), so it can be added to a CameraManager as both.
+    """
+
+    def __init__(self, camera_options=None, preview_options=None, share_frames=False, slots=3,
+                 max_frame_bytes=1920 * 1080 * 3, max_jpeg_bytes=4 * 1024 * 1024):
+        self.camera_options = camera_options or {}
+        self.preview_options = preview_options or {}
+        self.share_frames = share_frames
+        self.slots = slots
+        self.max_frame_bytes = max_frame_bytes
+        self.max_jpeg_bytes = max_jpeg_bytes
+        self.jpegs = None
+        self.frames = None
+        self.process = None
+        self._connection = None
+        self._connection_lock = threading.Lock()
+        self._readers_lock = threading.Lock()
+
+    def initialize(self):
+        if self.process is not None:
+            return
+        self.jpegs = SharedSlots(self.slots, self.max_jpeg_bytes)
+        frame_slots = None
+        if self.share_frames:
+            self.frames = SharedSlots(self.slots, self.max_frame_bytes)
+            frame_slots = (self.slots, self.max_frame_bytes, self.frames.name)
+        self._connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_worker_main, daemon=True,
+            args=(self.camera_options, self.preview_options, frame_slots,
+                  (self.slots, self.max_jpeg_bytes, self.jpegs.name), child_connection))
+        self.process.start()
+        child_connection.close()
+
+    def start(self):
+        pass  # Preview encoding runs in the worker, started by initialize()
+
+    def stop(self):
+        pass
+
+    def release(self):
+        if self.process is None:
+            return
+        try:
+            with self._connection_lock:
+                self._connection.send(('stop', ()))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+        self._connection.close()
+        self.jpegs.close(unlink=True)
+        if self.frames is not None:
+            self.frames.close(unlink=True)
+
+    def _call(self, name, *args):
+        with self._connection_lock:
+            try:
+                self._connection.send((name, args))
+                return self._connection.recv()
+            except (EOFError, OSError) as e:
+                print(f"Capture process unavailable: {e}")
+                return None
+
+    def get_best_jpeg(self, start, end):
+        return self._call('get_best_jpeg', start, end)
+
+    def get_scores(self, start, end):
+        return self._call('get_scores', start, end) or []
+
+    def get_jpeg_frame(self):
+        return self._call('get_jpeg_frame')
+
+    def get_frame_after(self, timestamp, timeout=1.0):
+        return self._call('get_frame_after', timestamp, timeout)
+
+    def get_frame_view(self):
+        """(timestamp, count, frame, token) mapped straight from shared memory, needs share_frames
+
+        The frame must not be modified and is only valid while frames.valid(token).
+        """
+        if self.frames is None:
+            return None
+        return self.frames.read(copy=False)
+
+    def get_frame(self):
+        if self.frames is None:
+            return None
+        latest = self.frames.read()
+        return latest[2] if latest is not None else None
+
+    def wait_for_jpeg(self, after_count=0, timeout=None):
+        """Wait for a preview JPEG newer than `after_count`, returns (jpeg, count)"""
+        if not self.jpegs.wait(after_count, timeout):
+            return None, after_count
+        latest = self.jpegs.read(copy=False)
+        if latest is None:
+            return None, after_count
+        _, count, data, token = latest
+        jpeg = data.tobytes()
+        if not self.jpegs.valid(token):
+            return None, after_count  # Overwritten while copying, the next call gets a newer one
+        return jpeg, count
+
+    def generate_frames(self):
+        """Generate multipart frames for one /video_feed client"""
+        with self._readers_lock:
+            self.jpegs.control[SharedSlots.READERS] += 1
+        try:
+            count = 0
+            while self.process is not None:
+                jpeg, count = self.wait_for_jpeg(count, timeout=1.0)
+                if jpeg is not None:
+                    yield (b'--frame\r\n'
+                           b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+        finally:
+            with self._readers_lock:
+                self.jpegs.control[SharedSlots.READERS] -= 1
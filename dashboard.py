@@ -1,32 +1,23 @@
 from flask import Flask, Response, render_template_string, request
-import cv2
+from camera import CameraHandler, FrameBroadcaster
 
 app = Flask(__name__)
 
 # Initialize the webcam (use 0 for the default camera, or a video file path)
-camera = cv2.VideoCapture(0)
-camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)  # Width
-camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)  # Height
+camera_handler = CameraHandler(0, width=1920, height=1080)
+# Frames are JPEG encoded once and shared by every /video_feed client. The page shows
+# the stream at most 800 px wide, full resolution frames are only used for captures.
+PREVIEW_WIDTH = 800
+PREVIEW_FPS = 15
+PREVIEW_QUALITY = 70
+frame_broadcaster = FrameBroadcaster(camera_handler, width=PREVIEW_WIDTH, fps=PREVIEW_FPS,
+                                     quality=PREVIEW_QUALITY)
 
 
-# Function to generate video frames
-def generate_frames():
-    while True:
-        success, frame = camera.read()  # Capture frame from the camera
-        if not success:
-            break
-        else:
-            # Encode the frame in JPEG format
-            _, buffer = cv2.imencode('.jpg', frame)
-            frame = buffer.tobytes()
-            # Yield the frame as part of an HTTP response
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-
 # Route for the video feed
 @app.route('/video_feed')
 def video_feed():
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return Response(frame_broadcaster.generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 # Main route to display the video, button, and message
 @app.route('/', methods=['GET', 'POST'])
@@ -156,4 +147,6 @@ def index():
 
 
 if __name__ == '__main__':
+    camera_handler.initialize()
+    frame_broadcaster.start()
     app.run(debug=True)
@@ -0,0 +1,98 @@
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+def decode_jpeg(jpeg):
+    """Decode JPEG bytes to a BGR image, None if they are not a valid image"""
+    return cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+TIMESTAMPED = re.compile(r'\d{8}-\d{6}-\d{9}_')  # Prefix save() gives timestamped names
+
+
+class FrameArchiver:
+    """Write received frames and detection images to disk on a background thread
+
+    save() only queues the data, so the gate never waits on the SD card. When
+    the writer falls behind by max_pending items new ones are dropped. With
+    max_files only that many timestamped files are kept, the oldest are
+    deleted, so the SD card does not fill up. With directory None nothing is
+    written at all.
+    """
+
+    def __init__(self, directory, max_pending=8, max_files=None):
+        self.directory = directory
+        self.max_files = max_files
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._kept = deque()  # Timestamped files written so far, oldest first
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            # Names sort by time, so the files of earlier runs are deleted first
+            self._kept.extend(os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                              if TIMESTAMPED.match(name))
+            threading.Thread(target=self._write_loop, name='archive', daemon=True).start()
+
+    def save(self, name, data, timestamped=True):
+        """Queue JPEG bytes, or an image array to encode on the writer thread
+
+        Arrays must not be modified afterwards. With timestamped the name gets
+        a time prefix, so frames are kept instead of overwriting each other.
+        Returns False when archiving is off, the data is empty or the writer
+        is behind.
+        """
+        if not self.directory:
+            return False
+        size = len(data) if isinstance(data, (bytes, bytearray, memoryview)) else data.size
+        if size == 0:
+            return False  # An empty crop, cv2.imencode would fail on it
+        name = os.path.basename(name)  # Upload file names come from the client
+        if timestamped:
+            name = time.strftime('%Y%m%d-%H%M%S') + f'-{time.time_ns() % 1_000_000_000:09d}_{name}'
+        try:
+            self._queue.put_nowait((os.path.join(self.directory, name), data, timestamped))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            print(f"Archive writer behind, not saving {name}")
+            return False
+
+    def _write_loop(self):
+        while True:
+            path, data, timestamped = self._queue.get()
+            try:
+                if not isinstance(data, (bytes, bytearray, memoryview)):
+                    success, buffer = cv2.imencode('.jpg', data)
+                    if not success:
+                        print(f"Error encoding {path}")
+                        continue
+                    data = buffer
+                with open(path, 'wb') as f:
+                    f.write(data)
+                if timestamped:
+                    self._kept.append(path)
+                    self._prune()
+            except Exception as e:  # A bad item must not stop the writer
+                print(f"Error archiving {path}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _prune(self):
+        while self.max_files is not None and len(self._kept) > self.max_files:
+            path = self._kept.popleft()
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def flush(self):
+        """Wait until everything queued so far is written"""
+        if self.directory:
+            self._queue.join()
@@ -0,0 +1,402 @@
+import json
+import os
+import shutil
+import struct
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# submit() results
+QUEUED = 'queued'
+MERGED = 'merged'  # Added to a queued event of the same lane
+SPOOLED = 'spooled'  # Memory queue full, written to the disk spool
+REJECTED = 'rejected'  # Queue and spool both full
+
+RECORD = struct.Struct('!II')  # Spool record: header length, frame data length
+
+
+class _Event:
+    """One upload to the Pi: the views of one or more merged triggers of a lane"""
+
+    def __init__(self, views, lane, created=None, triggers=1, spool_end=None):
+        self.views = views
+        self.lane = lane
+        self.created = created or time.time()
+        self.triggers = triggers
+        self.spool_end = spool_end  # Spool offset after this event's record, None if never spooled
+        self.errors = 0  # 5xx responses to this event's uploads
+
+
+class FrameUploader:
+    """Deliver trigger snapshots to the Raspberry Pi in order, without losing them
+
+    Events wait in a bounded memory queue. When it is full they are appended to
+    an on-disk spool under spool_dir, and once anything is spooled new events
+    go there too until the spool has drained, so delivery stays in trigger order.
+    The spool survives restarts. One delivery thread posts events over a
+    keep-alive requests.Session. While the Pi cannot be reached an upload is
+    retried with exponential backoff for as long as it takes; an upload the Pi
+    refuses with a 4xx, or fails with a 5xx max_errors times, is dropped and
+    counted in 'dropped' so it cannot hold up the events behind it. A trigger on a lane whose previous event is still
+    queued in memory and less than coalesce_window seconds old is merged into it
+    and sent as one multi-frame upload. Spooled events are never merged: their
+    records are fsynced once and not rewritten, so during a backlog each trigger
+    is its own upload. Frames are also written to archive_dir when set.
+
+    Nothing is read from the spool and nothing is sent until start(), so a
+    process that only imports the module, like Flask's reloader parent, leaves
+    the spool alone.
+    """
+
+    def __init__(self, url, timeout=5, archive_dir=None, max_queue=16, spool_dir=None,
+                 max_spool_bytes=512 * 1024 * 1024, coalesce_window=2.0,
+                 retry_delay=0.5, max_retry_delay=30.0, max_errors=5):
+        self.url = url
+        self.timeout = timeout
+        self.archive_dir = archive_dir
+        self.max_queue = max_queue
+        self.max_spool_bytes = max_spool_bytes
+        self.coalesce_window = coalesce_window
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_errors = max_errors
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if archive_dir:
+            os.makedirs(archive_dir, exist_ok=True)
+
+        self.queue = deque()
+        self.in_flight = None
+        self.condition = threading.Condition(threading.RLock())  # merge() is also called from submit()
+        self.running = False
+        self._thread = None
+        self._closing = threading.Event()
+
+        self.spool_path = None
+        self.spool_read = 0  # Offset of the first undelivered spool record
+        self.spool_size = 0
+        self._spooled = deque()  # Creation times of undelivered spool records
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+            self.spool_path = os.path.join(spool_dir, 'uploads.spool')
+
+        self.delivered = 0
+        self.merged = 0
+        self.rejected = 0
+        self.retries = 0
+        self.dropped = 0
+        self.last_delivery_lag = None
+
+    def start(self):
+        """Pick up the spool left by the last run and start delivering, before the first submit()"""
+        with self.condition:
+            if self._thread is not None:
+                return
+            if self.spool_path:
+                self._recover_spool()
+            self.running = True
+            self._thread = threading.Thread(target=self._deliver_loop, name='upload', daemon=True)
+            self._thread.start()
+
+    def submit(self, views, lane=None):
+        """Queue one trigger's frames, returns QUEUED, MERGED, SPOOLED or REJECTED
+
+        views is [(camera id, JPEG bytes)]. The first view goes in the 'file' field
+        the Pi reads, further views of the same vehicle as 'view_<camera id>'.
+        """
+        views = list(views)
+        with self.condition:
+            if self.merge(views, lane):
+                return MERGED
+            event = _Event(views, lane)
+            if not self._spooled and len(self.queue) < self.max_queue:
+                self.queue.append(event)
+                self.condition.notify()
+                return QUEUED
+            if self.spool_path is None or not self._spool(event):
+                self.rejected += 1
+                print(f"Upload queue full, dropping trigger on {lane or 'lane'}")
+                return REJECTED
+            self.condition.notify()
+            return SPOOLED
+
+    def merge(self, views, lane=None):
+        """Add views to the lane's queued event if it is within coalesce_window, returns True if it was
+
+        Only events in the memory queue can take more views, so this returns
+        False while anything is spooled.
+        """
+        with self.condition:
+            if not self.queue or self._spooled:
+                return False  # Spool records are not rewritten, in flight events already sent
+            last = self.queue[-1]
+            if last.lane != lane or time.time() - last.created > self.coalesce_window:
+                return False
+            last.views.extend(views)
+            last.triggers += 1
+            self.merged += 1
+            return True
+
+    def metrics(self):
+        """Queue depth, spool size and delivery lag in seconds"""
+        with self.condition:
+            waiting = [event.created for event in self.queue] + list(self._spooled)
+            if self.in_flight is not None:
+                waiting.append(self.in_flight.created)
+            return {
+                'queue_depth': len(self.queue),
+                'spooled_events': len(self._spooled),
+                'spool_bytes': self.spool_size - self.spool_read,
+                'in_flight': self.in_flight is not None,
+                'oldest_undelivered_age': time.time() - min(waiting) if waiting else 0.0,
+                'last_delivery_lag': self.last_delivery_lag,
+                'delivered': self.delivered,
+                'merged': self.merged,
+                'rejected': self.rejected,
+                'retries': self.retries,
+                'dropped': self.dropped,
+            }
+
+    # Spool: RECORD header, JSON event header, then the JPEGs back to back
+
+    def _spool(self, event, path=None):
+        header = json.dumps({
+            'created': event.created, 'lane': event.lane, 'triggers': event.triggers,
+            'views': [[camera_id, len(jpeg)] for camera_id, jpeg in event.views],
+        }).encode()
+        data_size = sum(len(jpeg) for _, jpeg in event.views)
+        record_size = RECORD.size + len(header) + data_size
+        if self.spool_size - self.spool_read + record_size > self.max_spool_bytes:
+            return False
+        try:
+            with open(path or self.spool_path, 'ab') as f:
+                f.write(RECORD.pack(len(header), data_size) + header)
+                for _, jpeg in event.views:
+                    f.write(jpeg)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            print(f"Error writing upload spool: {e}")
+            return False
+        self.spool_size += record_size
+        self._spooled.append(event.created)
+        return True
+
+    def _read_record(self, f):
+        # Next whole record from f as an _Event, None at the end or at a torn write
+        start = f.tell()
+        prefix = f.read(RECORD.size)
+        if len(prefix) < RECORD.size:
+            return None
+        header_size, data_size = RECORD.unpack(prefix)
+        header = f.read(header_size)
+        data = f.read(data_size)
+        if len(header) < header_size or len(data) < data_size:
+            return None
+        header = json.loads(header)
+        views = []
+        offset = 0
+        for camera_id, size in header['views']:
+            views.append((camera_id, data[offset:offset + size]))
+            offset += size
+        return _Event(views, header['lane'], header['created'], header['triggers'],
+                      spool_end=start + RECORD.size + header_size + data_size)
+
+    def _recover_spool(self):
+        if not os.path.exists(self.spool_path):
+            return
+        try:
+            with open(self.spool_path + '.offset') as f:
+                self.spool_read = int(f.read())
+        except (OSError, ValueError):
+            self.spool_read = 0
+        with open(self.spool_path, 'rb') as f:
+            f.seek(self.spool_read)
+            end = self.spool_read
+            while True:
+                event = self._read_record(f)
+                if event is None:
+                    break
+                self._spooled.append(event.created)
+                end = event.spool_end
+        # Drop a record torn by a crash while it was being written
+        os.truncate(self.spool_path, end)
+        self.spool_size = end
+        if self._spooled:
+            print(f"Resuming {len(self._spooled)} spooled uploads")
+        else:
+            self._reset_spool()
+
+    def _reset_spool(self):
+        for path in (self.spool_path, self.spool_path + '.offset'):
+            if os.path.exists(path):
+                os.remove(path)
+        self.spool_read = self.spool_size = 0
+
+    def _spool_delivered(self, event):
+        # Called with the condition held
+        self._spooled.popleft()
+        self.spool_read = event.spool_end
+        if not self._spooled:
+            self._reset_spool()
+            return
+        temporary = self.spool_path + '.offset.tmp'
+        with open(temporary, 'w') as f:
+            f.write(str(self.spool_read))
+        os.replace(temporary, self.spool_path + '.offset')
+
+    # Delivery
+
+    def _next_event(self):
+        with self.condition:
+            while self.running and not self.queue and not self._spooled:
+                self.condition.wait()
+            if not self.running:
+                return None
+            if self.queue:
+                self.in_flight = self.queue.popleft()
+                return self.in_flight
+            spool_read = self.spool_read
+        try:
+            # Only this thread reads the spool, submit() only appends to it
+            with open(self.spool_path, 'rb') as f:
+                f.seek(spool_read)
+                event = self._read_record(f)
+        except OSError as e:
+            print(f"Error reading upload spool: {e}")
+            event = None
+        if event is None:
+            return None
+        with self.condition:
+            self.in_flight = event
+        return event
+
+    def _deliver_loop(self):
+        while self.running:
+            event = self._next_event()
+            if event is None:
+                time.sleep(self.retry_delay)  # Closing, or the spool could not be read
+                continue
+            if self.archive_dir:
+                self._archive(event.views, event.lane)
+            delay = self.retry_delay
+            while self.running:
+                result = self._send(event)
+                if result is not None:
+                    break
+                if event.errors >= self.max_errors:
+                    print(f"Pi failed {event.errors} uploads from {event.lane or 'lane'}, dropping it")
+                    result = False
+                    break
+                self.retries += 1
+                self._closing.wait(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+            else:
+                with self.condition:
+                    self.in_flight = None
+                    if event.spool_end is None:
+                        self.queue.appendleft(event)  # Spooled by close()
+                break  # Closed
+            with self.condition:
+                self.in_flight = None
+                if result:
+                    self.delivered += 1
+                    self.last_delivery_lag = time.time() - event.created
+                else:
+                    self.dropped += 1
+                if event.spool_end is not None:
+                    self._spool_delivered(event)
+
+    def _send(self, event):
+        # True when delivered, False when the Pi refused it (no retry), None to retry
+        files = {}
+        names = []
+        for index, (camera_id, jpeg) in enumerate(event.views):
+            if index == 0:
+                name = 'file'
+                files[name] = ('frame.jpg', jpeg, 'image/jpeg')  # The name the Pi saved before
+            else:
+                name = f'view_{camera_id}'
+                if name in files:  # Same camera again from a merged trigger
+                    name = f'{name}_{index}'
+                files[name] = (f'{camera_id}.jpg', jpeg, 'image/jpeg')
+            names.append(str(camera_id))
+        data = {'views': ','.join(names), 'triggers': str(event.triggers)}
+        if event.lane is not None:
+            data['lane'] = event.lane
+        try:
+            response = self.session.post(self.url, files=files, data=data, timeout=self.timeout)
+        except Exception as e:
+            print(f"Failed to send frame, retrying: {e}")
+            return None
+        if response.status_code >= 500:
+            event.errors += 1
+            print(f"Pi failed to take frame, retrying: {response.status_code} {response.text}")
+            return None
+        print(f"Frame sent successfully: {response.text}")
+        return response.ok
+
+    def _archive(self, views, lane):
+        stamp = time.strftime('%Y%m%d-%H%M%S') + f'-{time.time_ns() % 1_000_000_000:09d}'
+        for index, (camera_id, jpeg) in enumerate(views):
+            path = os.path.join(self.archive_dir, f'{stamp}_{lane or "lane"}_{camera_id or "frame"}_{index}.jpg')
+            try:
+                with open(path, 'wb') as f:
+                    f.write(jpeg)
+            except OSError as e:
+                print(f"Error archiving frame: {e}")
+
+    def close(self, timeout=10):
+        """Stop after the queue drains or timeout passes; spooled events stay on disk"""
+        if self._thread is None:
+            # Never started: keep what was submitted without sending it
+            self.session.close()
+            with self.condition:
+                if self.queue and self.spool_path:
+                    self._recover_spool()  # So _persist_queue() keeps the spool already on disk
+                self._persist_queue()
+            return
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.condition:
+                if not self.queue and not self._spooled and self.in_flight is None:
+                    break
+            time.sleep(0.05)
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self._closing.set()
+        self._thread.join(timeout=self.timeout + 1)
+        self.session.close()
+        with self.condition:
+            self._persist_queue()
+
+    def _persist_queue(self):
+        # Put events still in memory in front of the spooled ones so the next start sends them
+        if not self.queue:
+            return
+        if self.spool_path is None:
+            print(f"Dropping {len(self.queue)} undelivered uploads")
+            return
+        temporary = self.spool_path + '.tmp'
+        spooled, self._spooled = self._spooled, deque()
+        spool_read, self.spool_read, self.spool_size = self.spool_read, 0, 0
+        for event in self.queue:
+            if not self._spool(event, temporary):
+                print(f"Dropping upload from {event.lane or 'lane'}, spool full")
+        self.queue.clear()
+        if spooled:
+            with open(self.spool_path, 'rb') as source, open(temporary, 'ab') as target:
+                source.seek(spool_read)
+                shutil.copyfileobj(source, target)
+                self.spool_size = target.tell()
+            self._spooled.extend(spooled)
+        if os.path.exists(self.spool_path + '.offset'):
+            os.remove(self.spool_path + '.offset')
+        os.replace(temporary, self.spool_path)
+        print(f"Spooled {len(self._spooled)} undelivered uploads for the next start")
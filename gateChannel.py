@@ -0,0 +1,358 @@
+import itertools
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+
+# Message kinds
+HELLO = 0  # Payload: sender's session id, sent first on every connection
+TRIGGER = 1  # Payload: JSON, e.g. {"lane": "lane1", "detected_at": <unix time>}
+FRAME = 2  # Payload: see encode_frame()
+ACK = 3  # Sequence is the acknowledged message's, no payload
+HEARTBEAT = 4
+
+HEADER = struct.Struct('!IBI')  # Payload length, kind, sequence
+MAX_PAYLOAD = 16 * 1024 * 1024
+MAX_PENDING = 256  # Unacknowledged messages kept per peer for resending
+HEARTBEAT_INTERVAL = 1.0
+HEARTBEAT_TIMEOUT = 3.0  # A connection with no traffic for this long is dropped
+CONNECT_TIMEOUT = 3.0
+RECONNECT_DELAY = 0.2
+MAX_RECONNECT_DELAY = 5.0
+
+
+def encode_json(data):
+    return json.dumps(data).encode()
+
+
+def decode_json(payload):
+    return json.loads(bytes(payload))
+
+
+def encode_trigger(lane, detected_at):
+    return encode_json({'lane': lane, 'detected_at': detected_at})
+
+
+def encode_frame(jpeg, metadata):
+    """Frame payload: 4 byte metadata length, JSON metadata, JPEG bytes"""
+    meta = encode_json(metadata)
+    return struct.pack('!I', len(meta)) + meta + jpeg
+
+
+def decode_frame(payload):
+    """Returns (metadata, JPEG as a memoryview into the payload)"""
+    view = memoryview(payload)
+    (size,) = struct.unpack_from('!I', view)
+    return json.loads(bytes(view[4:4 + size])), view[4 + size:]
+
+
+class _Peer:
+    """State kept per remote end, survives reconnects"""
+
+    def __init__(self):
+        self.session = None
+        self.connection = None
+        self.pending = OrderedDict()  # sequence -> (kind, payload), until acknowledged
+        self._seen = deque(maxlen=1024)
+        self._seen_set = set()
+
+    def first_time(self, sequence):
+        """False for a message already handled, e.g. resent because its ack was lost"""
+        if sequence in self._seen_set:
+            return False
+        if len(self._seen) == self._seen.maxlen:
+            self._seen_set.discard(self._seen[0])
+        self._seen.append(sequence)
+        self._seen_set.add(sequence)
+        return True
+
+    def reset(self, session):
+        self.session = session
+        self._seen.clear()
+        self._seen_set.clear()
+
+
+class _Connection:
+    def __init__(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Heartbeats keep a healthy connection busy, so a send to a peer that stopped
+        # reading, or a receive from one that stopped sending, fails instead of hanging
+        sock.settimeout(HEARTBEAT_TIMEOUT)
+        self.sock = sock
+        self.peer = None
+        self.last_received = time.monotonic()
+        self.closed = False
+        self._send_lock = threading.Lock()
+
+    def send(self, kind, sequence, payload=b''):
+        header = HEADER.pack(len(payload), kind, sequence)
+        with self._send_lock:
+            if len(payload) < 65536:
+                self.sock.sendall(header + payload)
+            else:
+                self.sock.sendall(header)  # Skip copying large payloads into one buffer
+                self.sock.sendall(payload)
+
+    def _receive_exactly(self, size):
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            count = self.sock.recv_into(view[received:])
+            if count == 0:
+                return None
+            received += count
+        return buffer
+
+    def messages(self):
+        """Yield (kind, sequence, payload) until the connection closes"""
+        while not self.closed:
+            header = self._receive_exactly(HEADER.size)
+            if header is None:
+                return
+            length, kind, sequence = HEADER.unpack(header)
+            if length > MAX_PAYLOAD:
+                print(f"Channel message of {length} bytes is too large, dropping connection")
+                return
+            payload = self._receive_exactly(length) if length else b''
+            if payload is None:
+                return
+            self.last_received = time.monotonic()
+            yield kind, sequence, payload
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class Channel(ABC):
+    """Long-lived TCP channel between the camera PC and a gate controller
+
+    Messages are length-prefixed with a kind and a sequence number. TRIGGER and
+    FRAME messages are acknowledged; unacknowledged ones are resent when the peer
+    reconnects and duplicates are dropped on arrival. Both ends send heartbeats
+    and drop a connection that goes quiet. Use ChannelServer or ChannelClient.
+    """
+
+    def __init__(self):
+        self.session = os.urandom(8).hex()
+        self.handlers = {}
+        self.peers = {}
+        self.connections = set()
+        self.running = False
+        self._lock = threading.Lock()
+        self._sequence = itertools.count(1)
+
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.messages_resent = 0
+        self.connects = 0
+
+    def on(self, kind, callback):
+        """Call callback(peer, sequence, payload) for each new message of this kind
+
+        Callbacks run on the connection's receive thread.
+        """
+        self.handlers[kind] = callback
+
+    def send(self, kind, payload=b'', peer=None):
+        """Send a message, queued until acknowledged; returns its sequence number"""
+        peer = peer or self._default_peer()
+        with self._lock:
+            sequence = next(self._sequence) & 0xFFFFFFFF
+            peer.pending[sequence] = (kind, payload)
+            while len(peer.pending) > MAX_PENDING:
+                peer.pending.popitem(last=False)
+            connection = peer.connection
+        if connection is not None:
+            self._transmit(connection, kind, sequence, payload)
+        return sequence
+
+    @abstractmethod
+    def _default_peer(self):
+        """Peer send() uses when none is given"""
+
+    @abstractmethod
+    def _peer_for(self, session):
+        """Peer state for a remote session id, called with the lock held"""
+
+    def _transmit(self, connection, kind, sequence, payload=b''):
+        try:
+            connection.send(kind, sequence, payload)
+            self.messages_sent += 1
+        except OSError:
+            connection.close()
+
+    def _serve(self, connection):
+        """Receive loop for one connection, returns once it is closed"""
+        with self._lock:
+            self.connections.add(connection)
+        self._transmit(connection, HELLO, 0, self.session.encode())
+        try:
+            for kind, sequence, payload in connection.messages():
+                self._dispatch(connection, kind, sequence, payload)
+        except OSError:
+            pass
+        finally:
+            connection.close()
+            with self._lock:
+                self.connections.discard(connection)
+                if connection.peer is not None and connection.peer.connection is connection:
+                    connection.peer.connection = None
+
+    def _dispatch(self, connection, kind, sequence, payload):
+        self.messages_received += 1
+        if kind == HELLO:
+            self._hello(connection, bytes(payload).decode())
+            return
+        peer = connection.peer
+        if peer is None or kind == HEARTBEAT:
+            return
+        if kind == ACK:
+            with self._lock:
+                peer.pending.pop(sequence, None)
+            return
+        self._transmit(connection, ACK, sequence)
+        if not peer.first_time(sequence):
+            return
+        handler = self.handlers.get(kind)
+        if handler is not None:
+            try:
+                handler(peer, sequence, payload)
+            except Exception as e:
+                print(f"Channel handler for message kind {kind} failed: {e}")
+
+    def _hello(self, connection, session):
+        with self._lock:
+            peer = self._peer_for(session)
+            if peer.session != session:
+                peer.reset(session)
+            previous = peer.connection
+            peer.connection = connection
+            connection.peer = peer
+            pending = list(peer.pending.items())
+        if previous is not None and previous is not connection:
+            previous.close()
+        for sequence, (kind, payload) in pending:
+            self._transmit(connection, kind, sequence, payload)
+            self.messages_resent += 1
+
+    def _heartbeat_loop(self):
+        while self.running:
+            now = time.monotonic()
+            with self._lock:
+                connections = list(self.connections)
+            for connection in connections:
+                if now - connection.last_received > HEARTBEAT_TIMEOUT:
+                    print("Channel peer went quiet, dropping connection")
+                    connection.close()
+                else:
+                    self._transmit(connection, HEARTBEAT, 0)
+            time.sleep(HEARTBEAT_INTERVAL)
+
+    def stop(self):
+        self.running = False
+        with self._lock:
+            connections = list(self.connections)
+        for connection in connections:
+            connection.close()
+
+
+class ChannelServer(Channel):
+    """Channel end on the camera PC, gate controllers connect to it"""
+
+    def __init__(self, host='0.0.0.0', port=5001):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self._listener = None
+
+    def _default_peer(self):
+        with self._lock:
+            connected = [peer for peer in self.peers.values() if peer.connection is not None]
+        if len(connected) != 1:
+            raise ValueError("Pass the peer to send to, more or fewer than one is connected")
+        return connected[0]
+
+    def _peer_for(self, session):
+        return self.peers.setdefault(session, _Peer())
+
+    def start(self):
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((self.host, self.port))
+        self._listener.listen()
+        self.port = self._listener.getsockname()[1]  # Resolved when started on port 0
+        self.running = True
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                sock, address = self._listener.accept()
+            except OSError:
+                break  # Listener closed
+            self.connects += 1
+            print(f"Channel connection from {address[0]}:{address[1]}")
+            threading.Thread(target=self._serve, args=(_Connection(sock),), daemon=True).start()
+
+    def stop(self):
+        super().stop()
+        if self._listener is not None:
+            self._listener.close()
+
+
+class ChannelClient(Channel):
+    """Channel end on the gate controller, keeps reconnecting to the camera PC"""
+
+    def __init__(self, host, port=5001):
+        super().__init__()
+        self.address = (host, port)
+        self.server = _Peer()
+
+    @property
+    def connected(self):
+        return self.server.connection is not None
+
+    def _default_peer(self):
+        return self.server
+
+    def _peer_for(self, session):
+        return self.server
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._connect_loop, daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+
+    def wait_connected(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.connected:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _connect_loop(self):
+        delay = RECONNECT_DELAY
+        while self.running:
+            try:
+                sock = socket.create_connection(self.address, timeout=CONNECT_TIMEOUT)
+            except OSError:
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+            delay = RECONNECT_DELAY
+            self.connects += 1
+            self._serve(_Connection(sock))
@@ -0,0 +1,200 @@
+import statistics
+import threading
+import time
+
+import requests
+from flask import Flask, Response, request
+from werkzeug.serving import make_server
+
+import gateChannel
+from frameUploader import FrameUploader
+
+FIXTURE = 'test.jpg'
+
+
+def load_jpeg(path=FIXTURE):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def start_http(app):
+    """Serve a Flask app on a free loopback port in a thread, returns (server, base url)"""
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.port}"
+
+
+class LoopbackGate:
+    """Camera PC and gate controller channel ends talking over loopback
+
+    The server answers every trigger with `jpeg` as a FRAME, like
+    http-pc-trigger.py does; frames received by the client are collected by
+    trigger sequence number.
+    """
+
+    def __init__(self, jpeg, port=0):
+        self.jpeg = jpeg
+        self.triggers_handled = 0
+        self.frames = {}  # trigger sequence -> (received at, frame payload size)
+        self.frame_received = threading.Condition()
+        self.server = self._start_server(port)
+        self.client = gateChannel.ChannelClient('127.0.0.1', self.server.port)
+        self.client.on(gateChannel.FRAME, self._on_frame)
+        self.client.start()
+
+    def _start_server(self, port):
+        server = gateChannel.ChannelServer('127.0.0.1', port)
+
+        def on_trigger(peer, sequence, payload):
+            self.triggers_handled += 1
+            server.send(gateChannel.FRAME, gateChannel.encode_frame(self.jpeg, {'trigger': sequence}), peer)
+
+        server.on(gateChannel.TRIGGER, on_trigger)
+        server.start()
+        return server
+
+    def restart_server(self, downtime=0.5):
+        """Stop the PC end and start a new one on the same port, like a PC restart"""
+        port = self.server.port
+        self.server.stop()
+        time.sleep(downtime)
+        self.server = self._start_server(port)
+
+    def _on_frame(self, peer, sequence, payload):
+        metadata, jpeg = gateChannel.decode_frame(payload)
+        with self.frame_received:
+            self.frames[metadata['trigger']] = (time.perf_counter(), len(jpeg))
+            self.frame_received.notify_all()
+
+    def trigger(self):
+        return self.client.send(gateChannel.TRIGGER, gateChannel.encode_trigger('lane1', time.time()))
+
+    def wait_for_frames(self, sequences, timeout=5.0):
+        with self.frame_received:
+            return self.frame_received.wait_for(
+                lambda: all(sequence in self.frames for sequence in sequences), timeout)
+
+    def close(self):
+        self.client.stop()
+        self.server.stop()
+
+
+def check_loopback(jpeg):
+    """Exercise the channel over loopback: round trip, dropped connection, PC restart"""
+    gate = LoopbackGate(jpeg)
+    results = []
+    try:
+        results.append(("connects", gate.client.wait_connected(timeout=2)))
+
+        sequence = gate.trigger()
+        delivered = gate.wait_for_frames([sequence])
+        results.append(("trigger answered with frame", delivered and gate.frames[sequence][1] == len(jpeg)))
+
+        # Drop the connection under the client, it reconnects and carries on
+        for connection in list(gate.server.connections):
+            connection.close()
+        sequences = [gate.trigger() for _ in range(3)]
+        results.append(("triggers delivered across a dropped connection", gate.wait_for_frames(sequences)))
+
+        # Triggers sent while the PC is down are queued and delivered once it is back
+        handled = gate.triggers_handled
+        gate.server.stop()
+        time.sleep(0.2)
+        sequences = [gate.trigger() for _ in range(3)]
+        gate.restart_server(downtime=0.3)
+        delivered = gate.wait_for_frames(sequences)
+        time.sleep(0.2)  # Give duplicates a chance to show up
+        results.append(("triggers queued while the PC was down", delivered))
+        results.append(("each trigger handled once", gate.triggers_handled - handled == len(sequences)))
+        results.append(("nothing left unacknowledged", not gate.client.server.pending))
+    finally:
+        gate.close()
+    for name, passed in results:
+        print(f"{'PASS' if passed else 'FAIL'}  {name}")
+    return all(passed for _, passed in results)
+
+
+def _percentiles(latencies):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000
+    return p50, p99, latencies[-1] * 1000
+
+
+def benchmark_latency(count=200):
+    """Per-event latency from the gate controller's trigger to having the frame
+
+    channel: trigger and frame over the persistent channel
+    http upload: POST /trigger, the PC then posts the frame to the Pi's /upload
+    http snapshot: GET /snapshot, the frame comes back in the response
+    """
+    jpeg = load_jpeg()
+    print(f"Frame: {FIXTURE}, {len(jpeg) / 1024:.0f} KB, {count} events per path")
+    print(f"{'path':<16} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+
+    gate = LoopbackGate(jpeg)
+    gate.client.wait_connected(timeout=2)
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        sequence = gate.trigger()
+        gate.wait_for_frames([sequence])
+        latencies.append(gate.frames[sequence][0] - start)
+    gate.close()
+    print(f"{'channel':<16} {'%8.2f %8.2f %8.2f' % _percentiles(latencies)}")
+
+    # Pi side: receives uploads like merged-control-system.py's /upload
+    uploaded = threading.Event()
+    pi = Flask('pi')
+
+    @pi.route('/upload', methods=['POST'])
+    def upload_file():
+        request.files['file'].read()
+        uploaded.set()
+        return "File frame.jpg uploaded successfully!", 200
+
+    pi_server, pi_url = start_http(pi)
+    uploader = FrameUploader(pi_url + '/upload')
+    uploader.start()
+
+    # PC side: /trigger uploads the frame, /snapshot returns it
+    pc = Flask('pc')
+
+    @pc.route('/trigger', methods=['POST'])
+    def handle_trigger():
+        uploader.submit([('camera', jpeg)], request.json.get('lane'))
+        return "Trigger processed", 200
+
+    @pc.route('/snapshot')
+    def snapshot():
+        return Response(jpeg, mimetype='image/jpeg')
+
+    pc_server, pc_url = start_http(pc)
+    session = requests.Session()
+
+    latencies = []
+    for _ in range(count):
+        uploaded.clear()
+        start = time.perf_counter()
+        # A new connection per trigger, as the Pi scripts post it
+        requests.post(pc_url + '/trigger', json={'trigger': 'object_detected', 'lane': 'lane1'})
+        uploaded.wait(5)
+        latencies.append(time.perf_counter() - start)
+    print(f"{'http upload':<16} {'%8.2f %8.2f %8.2f' % _percentiles(latencies)}")
+
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        session.get(pc_url + '/snapshot', params={'after': time.time(), 'lane': 'lane1'}).content
+        latencies.append(time.perf_counter() - start)
+    print(f"{'http snapshot':<16} {'%8.2f %8.2f %8.2f' % _percentiles(latencies)}")
+
+    session.close()
+    uploader.close()
+    pc_server.shutdown()
+    pi_server.shutdown()
+
+
+if __name__ == "__main__":
+    check_loopback(load_jpeg())
+    benchmark_latency()
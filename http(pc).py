@@ -1,42 +1,32 @@
 from flask import Flask, Response, render_template_string, request
 import os
-import cv2
 import threading
 import requests
+from camera import CameraHandler, FrameBroadcaster
 
 # Flask app setup
 app = Flask(__name__)
 
 # Webcam setup (use 0 for default camera)
-camera = cv2.VideoCapture(0)
-camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)  # Width
-camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)  # Height
+camera_handler = CameraHandler(0, width=1920, height=1080)
+# Frames are JPEG encoded once and shared by every /video_feed client. The page shows
+# the stream at most 800 px wide, full resolution frames are only used for captures.
+PREVIEW_WIDTH = 800
+PREVIEW_FPS = 15
+PREVIEW_QUALITY = 70
+frame_broadcaster = FrameBroadcaster(camera_handler, width=PREVIEW_WIDTH, fps=PREVIEW_FPS,
+                                     quality=PREVIEW_QUALITY)
 
 # Upload URL (Raspberry Pi)
 UPLOAD_URL = "http://10.15.20.11:5000/upload"  # Replace with actual Raspberry Pi IP
 FRAME_PATH = "frame.jpg"  # Temporary storage for the captured frame
 
 
-# Function to generate video frames
-def generate_frames():
-    global frame
-    while True:
-        success, frame = camera.read()  # Capture frame from the camera
-        if not success:
-            break
-        else:
-            # Encode the frame in JPEG format
-            _, buffer = cv2.imencode('.jpg', frame)
-            frame = buffer.tobytes()
-            # Yield the frame as part of an HTTP response
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-
 
 # Route for the video feed
 @app.route('/video_feed')
 def video_feed():
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return Response(frame_broadcaster.generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
 # Main route to display the video and handle manual control
@@ -94,10 +84,10 @@ def index():
 # Route to handle trigger from Raspberry Pi
 @app.route('/trigger', methods=['POST'])
 def handle_trigger():
-    global frame
     data = request.json
     if data.get('trigger') == 'object_detected':
         print("Trigger received from Raspberry Pi: Object detected!")
+        frame = camera_handler.get_jpeg_frame()
         if frame is not None:
             # Save the current frame to a file
             with open(FRAME_PATH, 'wb') as f:
@@ -116,5 +106,6 @@ def handle_trigger():
 
 # Start Flask app
 if __name__ == '__main__':
-    frame = None
+    camera_handler.initialize()
+    frame_broadcaster.start()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -1,126 +1,105 @@
-from flask import Flask, Response, render_template_string, request
-import os
-import cv2
+from flask import Flask, Response, render_template_string, request, jsonify
 import threading
-import requests
 import time
 from datetime import datetime, timedelta
+from camera import CameraHandler, CameraManager, FrameScorer
+from captureProcess import CaptureProcess
+from frameUploader import FrameUploader, REJECTED
+from gateChannel import ChannelServer, TRIGGER, FRAME, decode_json, encode_frame
+from jpegEncoder import create_encoder
 
 # Flask app setup
 app = Flask(__name__)
 
-# Camera handling class
-class CameraHandler:
-    def __init__(self):
-        self.camera = None
-        self.frame = None
-        self.lock = threading.Lock()
-        self.running = False
-        
-    def initialize(self):
-        if self.camera is None:
-            self.camera = cv2.VideoCapture(0)
-            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
-            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
-            self.running = True
-            # Start frame capture thread
-            threading.Thread(target=self._capture_frames, daemon=True).start()
-    
-    def _capture_frames(self):
-        while self.running:
-            if self.camera is None:
-                time.sleep(0.1)
-                continue
-                
-            success, frame = self.camera.read()
-            if success:
-                with self.lock:
-                    self.frame = frame
-            time.sleep(0.01)  # Small delay to prevent excessive CPU usage
-    
-    def get_frame(self):
-        with self.lock:
-            if self.frame is None:
-                return None
-            return self.frame.copy()
-    
-    def get_jpeg_frame(self):
-        frame = self.get_frame()
-        if frame is not None:
-            _, buffer = cv2.imencode('.jpg', frame)
-            return buffer.tobytes()
-        return None
-    
-    def release(self):
-        self.running = False
-        if self.camera is not None:
-            self.camera.release()
-            self.camera = None
+# Seconds of recent frames kept for picking the frame around a trigger (~6 MB per 1080p frame)
+FRAME_BUFFER_SECONDS = 1.0
+# The sharpest, stillest frame from this many seconds before the trigger is sent
+TRIGGER_LOOKBACK = 0.5
 
-# Initialize camera handler
-camera_handler = CameraHandler()
+# JPEG backend: 'auto' uses libjpeg-turbo when installed, otherwise OpenCV
+JPEG_BACKEND = 'auto'
+TRIGGER_QUALITY = 95
+# Ask the UVC camera for MJPEG and send its JPEGs as they are instead of decoding and re-encoding
+CAMERA_MJPEG = True
+
+# The page shows the stream at most 800 px wide, full resolution frames are only used for triggers
+PREVIEW_WIDTH = 800
+PREVIEW_FPS = 15
+PREVIEW_QUALITY = 70
+
+# Cameras on this PC: camera id -> (VideoCapture source, lane). Every camera of a lane
+# is a view of the same vehicle and all of them are sent when that lane triggers.
+CAMERAS = {
+    'lane1': (0, 'lane1'),
+}
+DEFAULT_LANE = 'lane1'  # Lane for triggers that do not name one
+# Run each camera's capture, scoring and preview encoding in its own worker process,
+# so stream and trigger handling here do not compete with it for the GIL
+CAPTURE_PROCESS = False
+
+# One capture thread per camera, frames are JPEG encoded once for all viewers of a camera,
+# each camera's preview with its own encoder
+camera_manager = CameraManager(preview=dict(
+    width=PREVIEW_WIDTH, fps=PREVIEW_FPS,
+    encoder=dict(backend=JPEG_BACKEND, quality=PREVIEW_QUALITY)))
+for camera_id, (source, lane) in CAMERAS.items():
+    if CAPTURE_PROCESS:
+        capture_process = CaptureProcess(
+            camera_options=dict(source=source, buffer_seconds=FRAME_BUFFER_SECONDS, scorer=FrameScorer(),
+                                encoder=dict(backend=JPEG_BACKEND, quality=TRIGGER_QUALITY), mjpeg=CAMERA_MJPEG),
+            preview_options=dict(width=PREVIEW_WIDTH, fps=PREVIEW_FPS,
+                                 encoder=dict(backend=JPEG_BACKEND, quality=PREVIEW_QUALITY)))
+        camera_manager.add(camera_id, capture_process, lane, broadcaster=capture_process)
+    else:
+        camera_manager.add(camera_id, CameraHandler(
+            source, buffer_seconds=FRAME_BUFFER_SECONDS, scorer=FrameScorer(),
+            encoder=create_encoder(JPEG_BACKEND, quality=TRIGGER_QUALITY), mjpeg=CAMERA_MJPEG), lane)
 
 # Upload URL (Raspberry Pi)
 UPLOAD_URL = "http://10.15.20.11:5000/upload"  # Replace with actual Raspberry Pi IP
-FRAME_PATH = "frame.jpg"  # Temporary storage for the captured frame
+ARCHIVE_DIR = None  # Directory to also keep every sent frame in, None to never touch the disk
+UPLOAD_QUEUE = 16  # Uploads waiting in memory while the Pi is slow or unreachable
+SPOOL_DIR = 'upload_spool'  # Further uploads wait here on disk and survive restarts, None to drop them
+MAX_SPOOL_MB = 512
+# Triggers during the cooldown are merged into the lane's upload if it is still queued in
+# memory; once uploads back up into the spool every trigger is sent on its own
+COALESCE_WINDOW = 5
+frame_uploader = FrameUploader(UPLOAD_URL, archive_dir=ARCHIVE_DIR, max_queue=UPLOAD_QUEUE,
+                               spool_dir=SPOOL_DIR, max_spool_bytes=MAX_SPOOL_MB * 1024 * 1024,
+                               coalesce_window=COALESCE_WINDOW)
+
+# /snapshot picks the best frame from this many seconds after the requested time
+SNAPSHOT_WINDOW = 0.3
 
-# Trigger control
+# Port of the persistent channel gate controllers can use instead of HTTP triggers and
+# uploads: a trigger on it is answered with the lane's frame on the same connection.
+# None to only serve HTTP.
+CHANNEL_PORT = None
+channel_server = ChannelServer(port=CHANNEL_PORT) if CHANNEL_PORT else None
+
+# Trigger control, the cooldown is kept per lane
 TRIGGER_COOLDOWN = 5  # Cooldown period in seconds
-last_trigger_time = None
+last_trigger_time = {}  # lane -> datetime of the last accepted trigger
 trigger_lock = threading.Lock()
 
-def is_trigger_allowed():
-    """Check if enough time has passed since the last trigger"""
-    global last_trigger_time
+def is_trigger_allowed(lane):
+    """Check if enough time has passed since the last trigger on this lane"""
     with trigger_lock:
         current_time = datetime.now()
-        if last_trigger_time is None or \
-           (current_time - last_trigger_time) > timedelta(seconds=TRIGGER_COOLDOWN):
-            last_trigger_time = current_time
+        last_time = last_trigger_time.get(lane)
+        if last_time is None or \
+           (current_time - last_time) > timedelta(seconds=TRIGGER_COOLDOWN):
+            last_trigger_time[lane] = current_time
             return True
         return False
 
-def generate_frames():
-    """Generate frames for video streaming"""
-    while True:
-        frame_data = camera_handler.get_jpeg_frame()
-        if frame_data is not None:
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_data + b'\r\n')
-        else:
-            time.sleep(0.1)
-
-def safe_write_frame(frame_data):
-    """Safely write frame data to file with proper cleanup"""
-    temp_path = f"{FRAME_PATH}.temp"
-    try:
-        # Write to temporary file first
-        with open(temp_path, 'wb') as f:
-            f.write(frame_data)
-        # Then rename it to the actual file (atomic operation)
-        os.replace(temp_path, FRAME_PATH)
-        return True
-    except Exception as e:
-        print(f"Error writing frame: {e}")
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        return False
-
-def send_frame_to_raspberry():
-    """Send the captured frame to Raspberry Pi"""
-    try:
-        with open(FRAME_PATH, 'rb') as f:
-            files = {'file': f}
-            response = requests.post(UPLOAD_URL, files=files, timeout=5)
-            print(f"Frame sent successfully: {response.text}")
-            return True
-    except Exception as e:
-        print(f"Failed to send frame: {e}")
-        return False
-
 @app.route('/video_feed')
-def video_feed():
-    return Response(generate_frames(), 
+@app.route('/video_feed/<camera_id>')
+def video_feed(camera_id=None):
+    camera_id = camera_id or camera_manager.lanes[DEFAULT_LANE][0]
+    if camera_id not in camera_manager.broadcasters:
+        return f"Unknown camera {camera_id}", 404
+    return Response(camera_manager.broadcasters[camera_id].generate_frames(),
                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/', methods=['GET', 'POST'])
@@ -196,7 +175,9 @@ def index():
         </header>
         <main>
             <h1>Live Video Stream</h1>
-            <img src="/video_feed" alt="Video Stream">
+            {% for camera_id in cameras %}
+            <img src="/video_feed/{{ camera_id }}" alt="{{ camera_id }}">
+            {% endfor %}
             <form method="post">
                 <button type="submit">Manual Open Gate</button>
             </form>
@@ -209,50 +190,156 @@ def index():
         </footer>
     </body>
     </html>
-    ''', message=message)
+    ''', message=message, cameras=list(camera_manager.cameras))
+
+@app.route('/scores')
+@app.route('/scores/<camera_id>')
+def frame_scores(camera_id=None):
+    """Scores of the buffered frames, for tuning the frame scorer"""
+    camera_handler = camera_manager.get(camera_id or camera_manager.lanes[DEFAULT_LANE][0])
+    if camera_handler is None:
+        return f"Unknown camera {camera_id}", 404
+    now = time.monotonic()
+    scores = camera_handler.get_scores(now - FRAME_BUFFER_SECONDS, now)
+    return jsonify([
+        {'age': now - timestamp, 'sequence': sequence,
+         'sharpness': sharpness, 'motion': motion, 'score': score}
+        for timestamp, sequence, sharpness, motion, score in scores
+    ])
+
+def pick_snapshot(camera_handler, after):
+    """Best frame from SNAPSHOT_WINDOW after unix time `after`, returns (best, wall_offset)"""
+    # Capture times are time.monotonic(), the Pi sends wall clock time
+    wall_offset = time.time() - time.monotonic()
+    start = after - wall_offset
+    end = start + SNAPSHOT_WINDOW
+    wait = end - time.monotonic()
+    if wait > 0:
+        time.sleep(min(wait, SNAPSHOT_WINDOW))
+    return camera_handler.get_best_jpeg(start, end), wall_offset
+
+@app.route('/metrics')
+def upload_metrics():
+    """Upload queue depth, spool size and delivery lag"""
+    return jsonify(frame_uploader.metrics())
+
+@app.route('/snapshot')
+def snapshot():
+    """Best frame captured after ?after=<unix time> on ?lane= (or ?camera=), as JPEG
+
+    Lets the Pi pull the frame in one round trip instead of triggering an upload.
+    after defaults to now. Capture metadata is in the X- response headers.
+    """
+    lane = request.args.get('lane', DEFAULT_LANE)
+    camera_id = request.args.get('camera')
+    if camera_id is None:
+        if lane not in camera_manager.lanes:
+            return f"Unknown lane {lane}", 404
+        camera_id = camera_manager.lanes[lane][0]
+    camera_handler = camera_manager.get(camera_id)
+    if camera_handler is None:
+        return f"Unknown camera {camera_id}", 404
+    try:
+        after = float(request.args.get('after', time.time()))
+    except ValueError:
+        return "after must be a unix timestamp", 400
+
+    best, wall_offset = pick_snapshot(camera_handler, after)
+    if best is None:
+        return "No frame available", 404
+    timestamp, sequence, jpeg, scores = best
+    headers = {
+        'X-Capture-Time': f"{timestamp + wall_offset:.6f}",
+        'X-Frame-Sequence': str(sequence),
+        'X-Camera': camera_id,
+        'X-Lane': lane,
+    }
+    if scores is not None:
+        headers['X-Frame-Scores'] = ','.join(f"{score:.3f}" for score in scores)
+    return Response(jpeg, mimetype='image/jpeg', headers=headers)
 
 @app.route('/trigger', methods=['POST'])
 def handle_trigger():
     data = request.json
     
     if data.get('trigger') == 'object_detected':
+        lane = data.get('lane', DEFAULT_LANE)
+        if lane not in camera_manager.lanes:
+            return f"Unknown lane {lane}", 404
+        # Pick the best scoring frame of every view of the lane from just before the trigger
+        trigger_time = time.monotonic()
+        views = camera_manager.get_best_jpegs(lane, trigger_time - TRIGGER_LOOKBACK, trigger_time)
+        if not views:
+            return "No frame available", 400
+        jpegs = [(camera_id, best[2]) for camera_id, best in views]
+
         # Check if we're allowed to process this trigger
-        if not is_trigger_allowed():
-            print(f"Trigger ignored - cooldown period ({TRIGGER_COOLDOWN}s) not elapsed")
+        if not is_trigger_allowed(lane):
+            if frame_uploader.merge(jpegs, lane):
+                print(f"Trigger during cooldown on {lane} merged into the queued upload")
+                return "Trigger merged", 200
+            print(f"Trigger ignored - cooldown period ({TRIGGER_COOLDOWN}s) not elapsed on {lane}")
             return "Trigger ignored (cooldown)", 429
         
-        print("Trigger received from Raspberry Pi: Object detected!")
-        
-        # Get the current frame
-        frame_data = camera_handler.get_jpeg_frame()
-        if frame_data is not None:
-            try:
-                # Write frame to file
-                if safe_write_frame(frame_data):
-                    # Send frame in a separate thread
-                    thread = threading.Thread(target=send_frame_to_raspberry)
-                    thread.daemon = True
-                    thread.start()
-                    return "Trigger processed", 200
-                else:
-                    return "Error saving frame", 500
-            except Exception as e:
-                print(f"Error processing trigger: {e}")
-                return "Error processing trigger", 500
-        else:
-            return "No frame available", 400
+        print(f"Trigger received from Raspberry Pi: Object detected on {lane}!")
+        for camera_id, (_, sequence, _, scores) in views:
+            print(f"Sending {camera_id} frame {sequence}, scores (sharpness, motion, score): {scores}")
+        # Queued in memory, or on disk while the Pi is behind
+        if frame_uploader.submit(jpegs, lane) == REJECTED:
+            return "Upload queue full", 503
+        return "Trigger processed", 200
             
     return "Invalid trigger", 400
 
+def handle_channel_trigger(peer, sequence, payload):
+    """Answer a trigger from the gate channel with one FRAME per camera of the lane, like /trigger
+
+    Triggers resent after a reconnect can be older than the frame buffer. Their
+    frames are gone, so they are dropped rather than answered with the current
+    frame, which would show whatever vehicle is at the gate now.
+    """
+    trigger = decode_json(payload)
+    lane = trigger.get('lane', DEFAULT_LANE)
+    views = camera_manager.views(lane)
+    if not views:
+        print(f"Channel trigger for unknown lane {lane}")
+        return
+    detected_at = trigger.get('detected_at', time.time())
+    if time.time() - detected_at > FRAME_BUFFER_SECONDS:
+        print(f"Channel trigger {sequence} on {lane} is {time.time() - detected_at:.1f}s old, dropping it")
+        return
+    for camera_id, camera_handler in views:
+        best, wall_offset = pick_snapshot(camera_handler, detected_at)
+        if best is None:
+            print(f"No {camera_id} frame available for channel trigger {sequence} on {lane}")
+            continue
+        timestamp, frame_sequence, jpeg, scores = best
+        capture_time = timestamp + wall_offset
+        if abs(capture_time - detected_at) > FRAME_BUFFER_SECONDS:
+            # get_best_jpeg() fell back to a latest frame far from the trigger
+            print(f"No {camera_id} frame near channel trigger {sequence} on {lane}")
+            continue
+        print(f"Sending {camera_id} frame {frame_sequence} over the channel, scores: {scores}")
+        # detected_at is the Pi's own time, so it can tell a frame resent after a reconnect is stale
+        channel_server.send(FRAME, encode_frame(jpeg, {
+            'trigger': sequence, 'lane': lane, 'camera': camera_id, 'views': len(views),
+            'sequence': frame_sequence, 'capture_time': capture_time, 'detected_at': detected_at,
+            'age': time.time() - capture_time, 'scores': scores,
+        }), peer)
+
 if __name__ == '__main__':
     try:
-        # Initialize camera
-        camera_handler.initialize()
-        
-        # Ensure the frame file doesn't exist at startup
-        if os.path.exists(FRAME_PATH):
-            os.remove(FRAME_PATH)
-            
-        app.run(host='0.0.0.0', port=5000, debug=True)
+        # Initialize cameras
+        camera_manager.initialize()
+        frame_uploader.start()
+        if channel_server is not None:
+            channel_server.on(TRIGGER, handle_channel_trigger)
+            channel_server.start()
+        # The reloader would run this block again in a child process, opening the
+        # cameras and binding CHANNEL_PORT a second time
+        app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
     finally:
-        camera_handler.release()
\ No newline at end of file
+        if channel_server is not None:
+            channel_server.stop()
+        camera_manager.release()
+        frame_uploader.close()
\ No newline at end of file
@@ -4,11 +4,14 @@ import requests
 import threading
 import RPi.GPIO as GPIO
 import time
+from frameArchiver import FrameArchiver
 
 # Flask app setup
 app = Flask(__name__)
 UPLOAD_FOLDER = '/home/pi/Desktop/Uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Uploads are written in the background so the response does not wait on the SD card
+frame_archiver = FrameArchiver(UPLOAD_FOLDER)
 
 # GPIO setup
 IR_SENSOR_PIN = 4
@@ -26,8 +29,9 @@ def upload_file():
     file = request.files['file']
     if file.filename == '':
         return 'No selected file', 400
-    file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(file_path)
+    if not frame_archiver.save(file.filename, file.read(), timestamped=False):
+        # Writer behind: a 5xx makes the PC retry instead of losing the frame
+        return f"File {file.filename} not saved, try again", 503
     return f"File {file.filename} uploaded successfully!", 200
 
 # Function to monitor IR sensor and send trigger to PC
@@ -0,0 +1,114 @@
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+
+class OpenCVEncoder:
+    """JPEG encoding with cv2.imencode"""
+
+    name = 'opencv'
+
+    def __init__(self, quality=95, optimize=False, progressive=False):
+        self.quality = quality
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, quality,
+                       cv2.IMWRITE_JPEG_OPTIMIZE, int(optimize),
+                       cv2.IMWRITE_JPEG_PROGRESSIVE, int(progressive)]
+
+    def encode(self, frame):
+        success, buffer = cv2.imencode('.jpg', frame, self.params)
+        if not success:
+            return None
+        return buffer.tobytes()
+
+
+class TurboJPEGEncoder:
+    """JPEG encoding with libjpeg-turbo through PyTurboJPEG
+
+    Raises ImportError or OSError when the binding or the library is missing.
+    """
+
+    name = 'turbojpeg'
+
+    def __init__(self, quality=95, subsampling='420', fast_dct=True):
+        from turbojpeg import TurboJPEG, TJSAMP_420, TJSAMP_422, TJSAMP_444, TJFLAG_FASTDCT
+        self.quality = quality
+        self.subsampling = {'420': TJSAMP_420, '422': TJSAMP_422, '444': TJSAMP_444}[subsampling]
+        self.flags = TJFLAG_FASTDCT if fast_dct else 0
+        self._turbo = TurboJPEG()
+        self._lock = threading.Lock()  # One TurboJPEG handle is not safe to share between threads
+
+    def encode(self, frame):
+        with self._lock:
+            return self._turbo.encode(frame, quality=self.quality,
+                                      jpeg_subsample=self.subsampling, flags=self.flags)
+
+
+class ThreadPoolEncoder:
+    """Encode on a bounded pool of worker threads, for several streams at once
+
+    Each worker gets its own backend encoder from `factory`. Both OpenCV and
+    libjpeg-turbo release the GIL while encoding, so streams encode in parallel
+    while the number of busy cores stays bounded by `workers`.
+    """
+
+    name = 'threadpool'
+
+    def __init__(self, factory, workers=4):
+        self.factory = factory
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='jpeg')
+
+    def _encode(self, frame):
+        encoder = getattr(self._local, 'encoder', None)
+        if encoder is None:
+            encoder = self._local.encoder = self.factory()
+        return encoder.encode(frame)
+
+    def submit(self, frame):
+        """Encode in the background, returns a Future with the JPEG bytes
+
+        The frame must not change until the future is done.
+        """
+        return self._pool.submit(self._encode, frame)
+
+    def encode(self, frame):
+        return self.submit(frame).result()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+ENCODERS = {
+    'opencv': OpenCVEncoder,
+    'turbojpeg': TurboJPEGEncoder,
+}
+
+
+def create_encoder(backend='auto', quality=95, workers=0, **options):
+    """Build a JPEG encoder by name, falling back to OpenCV when a backend is unavailable
+
+    backend is 'auto' (libjpeg-turbo if installed, otherwise OpenCV), 'turbojpeg'
+    or 'opencv'. With workers > 0 encoding runs on a ThreadPoolEncoder.
+    """
+    names = ['turbojpeg', 'opencv'] if backend == 'auto' else [backend, 'opencv']
+    for name in names:
+        if name not in ENCODERS:
+            raise ValueError(f"Unknown JPEG encoder backend: {name}")
+        encoder_class = ENCODERS[name]
+        # Options only go to the backends that take them, e.g. optimize is OpenCV only
+        accepted = inspect.signature(encoder_class).parameters
+        kwargs = {key: value for key, value in options.items() if key in accepted}
+
+        def factory(encoder_class=encoder_class, kwargs=kwargs):
+            return encoder_class(quality=quality, **kwargs)
+        try:
+            encoder = factory()
+        except (ImportError, OSError) as e:
+            if backend != 'auto':
+                print(f"JPEG encoder '{name}' unavailable ({e}), falling back to OpenCV")
+            continue
+        if workers:
+            return ThreadPoolEncoder(factory, workers)
+        return encoder
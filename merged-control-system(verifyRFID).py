@@ -7,6 +7,10 @@ import sqlite3
 import re
 import RPi.GPIO as GPIO
 import rfid
+import rfidRecorder
+import gateChannel
+from frameArchiver import FrameArchiver, decode_jpeg
+from uploadRequest import keep_uploads_in_memory
 import threading
 import requests
 import hashlib
@@ -18,8 +22,15 @@ from cryptography.hazmat.primitives.serialization import load_pem_private_key
 
 # Flask app setup
 app = Flask(__name__)
+keep_uploads_in_memory(app)  # Frames are too big for Werkzeug's in-memory limit
 UPLOAD_FOLDER = '/home/pi/Desktop/Uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Frames are decoded in memory and passed on as arrays; copies of them and of the
+# detection images are written here in the background. False to keep the SD card out of it.
+ARCHIVE_FRAMES = True
+ARCHIVE_MAX_FILES = 200  # Oldest timestamped copies are deleted past this, about 80 MB of frames
+frame_archiver = FrameArchiver(UPLOAD_FOLDER if ARCHIVE_FRAMES else None, max_files=ARCHIVE_MAX_FILES)
+TEST_IMAGE = '797614.jpg'  # Detect on this file instead of the received frame, None to use the frame
 os.makedirs('captured', exist_ok=True)
 
 # GPIO setup
@@ -37,9 +48,17 @@ pwm.start(0)
 plateDetected = False
 rfid_done = False
 yolo_done = False
+vehicle_detected_at = None  # time.monotonic() of the last IR sensor trigger
 
 # Initialize RFID reader
 rfidReader = rfid.RFIDReader()
+RFID_TIMEOUT = 5  # Seconds to wait for a tag after the upload arrives
+RFID_LOOKBACK = 2  # Seconds before the IR trigger a tag read still counts
+RFID_WINDOW = 1  # Seconds without a read before a tag's read group is restarted
+RFID_EPC_PREFIX = None  # Hex EPC prefix of enrolled tags, e.g. "E200001702", to ignore foreign tags
+RFID_RAW_LOG = None  # Path to record every raw read, e.g. "rfid_reads.db", for antenna tuning
+rfidLookup = rfid.ExpiringDict(default_expiry=5)
+rfidHandler = rfid.TagHandler(rfidLookup, rfidReader, window=RFID_WINDOW)
 connection = sqlite3.connect(db)
 cursor = connection.cursor()
 
@@ -56,6 +75,20 @@ CLIENTPLATE = InferenceHTTPClient(
 
 # PC server details
 PC_TRIGGER_URL = "http://192.168.18.96:5000/trigger"
+# Pull the frame from the PC's /snapshot instead of having the PC upload it after /trigger.
+# Only http-pc-trigger.py serves /snapshot, leave this off with the other PC servers.
+PULL_SNAPSHOT = False
+PC_SNAPSHOT_URL = "http://192.168.18.96:5000/snapshot"
+LANE_ID = "lane1"  # Lane this controller serves, as configured on the PC
+SNAPSHOT_TIMEOUT = 5
+# Keep one TCP channel open to the PC and send triggers and receive frames over it,
+# instead of an HTTP request per vehicle. Needs CHANNEL_PORT set on the PC.
+USE_CHANNEL = False
+PC_CHANNEL_HOST = "192.168.18.96"
+PC_CHANNEL_PORT = 5001
+# Frames for a vehicle detected longer ago than this, e.g. resent after a reconnect, are discarded
+CHANNEL_FRAME_MAX_AGE = 3.0
+gate_channel = gateChannel.ChannelClient(PC_CHANNEL_HOST, PC_CHANNEL_PORT) if USE_CHANNEL else None
 
 # Helper Functions
 def set_angle(angle):
@@ -109,8 +142,8 @@ def searchDB(plate):
 def millis_time():
     return round(time.time() * 1000)
 
-def ocr(filepath):
-    result = CLIENT.ocr_image(inference_input=filepath)
+def ocr(image):
+    result = CLIENT.ocr_image(inference_input=image)
     print("OCR Result: ", result)
     plate = extract_plate_number(result)
     print("Plate Number: ", plate)
@@ -118,15 +151,15 @@ def ocr(filepath):
     global plateDetected
     plateDetected = True
 
-def detectPlateNumber(filepath):
+def detectPlateNumber(image):
     print("Detect Plate Number Function")
-    filepath = '797614.jpg'
-    result = CLIENTPLATE.infer(filepath, model_id="plate-detection-svkgg/1")
-    print(result)
-    image = cv2.imread(filepath)
+    if TEST_IMAGE:
+        image = cv2.imread(TEST_IMAGE)
     if image is None:
         print("Error: Unable to load the image.")
         return False
+    result = CLIENTPLATE.infer(image, model_id="plate-detection-svkgg/1")
+    print(result)
 
     confidence = 0
     if "predictions" in result:
@@ -144,31 +177,27 @@ def detectPlateNumber(filepath):
 
             cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
             cropped_image = image[y1:y2, x1:x2]
-            cropped_path = f"cropped_img.jpg"
-            cv2.imwrite(cropped_path, cropped_image)
+            frame_archiver.save("cropped_img.jpg", cropped_image.copy(), timestamped=False)
     print("Confidence ", confidence)
     ocr(image)
     # if confidence > 0.85:
     #     ocr(image)
-    cv2.imwrite("Labeled_Result.jpg", image)
+    frame_archiver.save("Labeled_Result.jpg", image, timestamped=False)
     return True
 
 def handle_rfid():
     global rfid_done
     global rfid_tag
-    max_attempts = 5
-    attempt = 0
-    
-    while attempt < max_attempts:
-        rfid_result = rfidReader.read_response()
-        if rfid_result:
-            print(f"RFID found: {rfid_result}")
-            rfid_tag = rfid_result
-            rfid_done = True
-            return
-        print(f"RFID read failed, retrying... ({attempt + 1}/{max_attempts})")
-        attempt += 1
-        time.sleep(1)
+    since = (vehicle_detected_at or time.monotonic()) - RFID_LOOKBACK
+    tag = rfidReader.wait_for_tag(timeout=RFID_TIMEOUT, since=since)
+    if tag:
+        # Several tags may be in range, take the strongest one read for this vehicle
+        best = rfidHandler.best_candidate(since)
+        tag_number = best.tag_number if best else tag.tag_number
+        print(f"RFID found: {tag_number}")
+        rfid_tag = tag_number
+        rfid_done = True
+        return
 
     print("RFID not found.")
     rfid_done = False
@@ -266,23 +295,63 @@ def upload_file():
     file = request.files['file']
     if file.filename == '':
         return 'No selected file', 400
-    file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(file_path)
+    jpeg = file.read()
+    image = decode_jpeg(jpeg)
+    if image is None:
+        return 'File is not an image', 400
+    frame_archiver.save(file.filename, jpeg)
     
     # Trigger processing after file upload
-    process_thread = threading.Thread(target=process_detection, args=(file_path,))
+    process_thread = threading.Thread(target=process_detection, args=(image,))
     process_thread.start()
     
     return f"File {file.filename} uploaded successfully!", 200
 
-def process_detection(file_path):
+def process_detection(image):
     handle_rfid()
     print("Detecting Plate Number..")
     if rfid_done:
-        print("Filepath: ", file_path)
-        detectPlateNumber(file_path)
+        print("Frame: ", image.shape)
+        detectPlateNumber(image)
+
+def pull_snapshot(detected_at):
+    """Fetch the frame captured after the vehicle was detected from the PC and process it"""
+    try:
+        response = requests.get(PC_SNAPSHOT_URL, params={'after': detected_at, 'lane': LANE_ID},
+                                timeout=SNAPSHOT_TIMEOUT)
+        if response.status_code != 200:
+            print(f"No snapshot from PC: {response.status_code} {response.text}")
+            return
+        print(f"Snapshot {response.headers.get('X-Frame-Sequence')} from {response.headers.get('X-Camera')} "
+              f"captured at {response.headers.get('X-Capture-Time')}")
+        image = decode_jpeg(response.content)
+        if image is None:
+            print("Snapshot from PC is not an image")
+            return
+        frame_archiver.save('frame.jpg', response.content)
+        process_detection(image)
+    except Exception as e:
+        print(f"Failed to pull snapshot from PC: {e}")
+
+def handle_channel_frame(peer, sequence, payload):
+    """Process a frame the PC sent over the channel in answer to a trigger"""
+    metadata, jpeg = gateChannel.decode_frame(payload)
+    print(f"Frame {metadata.get('sequence')} from {metadata.get('camera')} for trigger "
+          f"{metadata.get('trigger')}, captured at {metadata.get('capture_time')}")
+    age = time.time() - metadata.get('detected_at', time.time())
+    if age > CHANNEL_FRAME_MAX_AGE:
+        print(f"Frame for a vehicle detected {age:.1f}s ago, discarding it")
+        return
+    image = decode_jpeg(jpeg)
+    if image is None:
+        print("Frame from PC is not an image")
+        return
+    frame_archiver.save('frame.jpg', jpeg)
+    # Off the channel's receive thread, process_detection waits for the RFID tag
+    threading.Thread(target=process_detection, args=(image,), daemon=True).start()
 
 def monitor_sensor():
+    global vehicle_detected_at
     vehicle_detected = False
     
     while True:
@@ -291,6 +360,16 @@ def monitor_sensor():
         if not sensor_status and not vehicle_detected:
             print("Vehicle Detected")
             vehicle_detected = True
+            vehicle_detected_at = time.monotonic()
+            if gate_channel is not None:
+                # Queued and resent by the channel if the PC is not connected right now
+                gate_channel.send(gateChannel.TRIGGER, gateChannel.encode_trigger(LANE_ID, time.time()))
+                time.sleep(5)
+                continue
+            if PULL_SNAPSHOT:
+                threading.Thread(target=pull_snapshot, args=(time.time(),), daemon=True).start()
+                time.sleep(5)
+                continue
             try:
                 response = requests.post(PC_TRIGGER_URL, json={"trigger": "object_detected"})
                 print(f"Trigger sent to PC. Response: {response.text}")
@@ -307,10 +386,18 @@ def monitor_sensor():
 def main():
     try:
         # Initialize RFID
-        rfidLookup = rfid.ExpiringDict(default_expiry=5)
-        rfidHandler = rfid.TagHandler(rfidLookup, rfidReader)
         rfidReader.on_tag_read(rfidHandler.handle_tag)
+        if RFID_EPC_PREFIX:
+            rfidReader.set_epc_filters(rfid.EPCFilter.prefix(RFID_EPC_PREFIX))
+        if RFID_RAW_LOG:
+            rfidReader.recorder = rfidRecorder.RawReadRecorder(RFID_RAW_LOG)
+            rfidReader.recorder.start()
         rfidReader.start_inventory()
+        rfidReader.start_reading()
+
+        if gate_channel is not None:
+            gate_channel.on(gateChannel.FRAME, handle_channel_frame)
+            gate_channel.start()
 
         # Start sensor monitoring in a separate thread
         sensor_thread = threading.Thread(target=monitor_sensor)
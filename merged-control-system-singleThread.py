@@ -7,6 +7,8 @@ import sqlite3
 import re
 import RPi.GPIO as GPIO
 import rfid
+from frameArchiver import FrameArchiver, decode_jpeg
+from uploadRequest import keep_uploads_in_memory
 import requests
 import hashlib
 from cryptography.hazmat.primitives.asymmetric import rsa
@@ -17,8 +19,14 @@ from cryptography.hazmat.primitives.serialization import load_pem_private_key
 
 # Flask app setup
 app = Flask(__name__)
+keep_uploads_in_memory(app)  # Frames are too big for Werkzeug's in-memory limit
 UPLOAD_FOLDER = '/home/pi/Desktop/Uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Frames are decoded in memory and passed on as arrays; copies of them and of the
+# detection images are written here in the background. False to keep the SD card out of it.
+ARCHIVE_FRAMES = True
+ARCHIVE_MAX_FILES = 200  # Oldest timestamped copies are deleted past this, about 80 MB of frames
+frame_archiver = FrameArchiver(UPLOAD_FOLDER if ARCHIVE_FRAMES else None, max_files=ARCHIVE_MAX_FILES)
 os.makedirs('captured', exist_ok=True)
 
 # GPIO setup
@@ -34,6 +42,12 @@ pwm.start(0)
 
 # Initialize RFID reader
 rfidReader = rfid.RFIDReader()
+RFID_TIMEOUT = 5  # Seconds to wait for a tag after the upload arrives
+RFID_LOOKBACK = 10  # Seconds before the upload a tag read still counts
+RFID_WINDOW = 1  # Seconds without a read before a tag's read group is restarted
+RFID_EPC_PREFIX = None  # Hex EPC prefix of enrolled tags, e.g. "E200001702", to ignore foreign tags
+rfidLookup = rfid.ExpiringDict(default_expiry=5)
+rfidHandler = rfid.TagHandler(rfidLookup, rfidReader, window=RFID_WINDOW)
 connection = sqlite3.connect(db)
 cursor = connection.cursor()
 
@@ -90,21 +104,21 @@ def searchDB(plate):
         print("No matching plate found.")
         return None
 
-def ocr(filepath):
-    result = CLIENT.ocr_image(inference_input=filepath)
+def ocr(image):
+    result = CLIENT.ocr_image(inference_input=image)
     print("OCR Result: ", result)
     plate = extract_plate_number(result)
     print("Plate Number: ", plate)
     searchDB(plate)
 
-def detectPlateNumber(filepath):
+def detectPlateNumber(image):
     print("Detect Plate Number Function")
-    result = CLIENTPLATE.infer(filepath, model_id="plate-detection-svkgg/1")
-    print(result)
-    image = cv2.imread(filepath)
     if image is None:
         print("Error: Unable to load the image.")
         return False
+    result = CLIENTPLATE.infer(image, model_id="plate-detection-svkgg/1")
+    print(result)
+    labeled = image.copy()  # OCR runs on the unmarked frame
 
     confidence = 0
     if "predictions" in result:
@@ -120,37 +134,32 @@ def detectPlateNumber(filepath):
             x2 = x + width // 2
             y2 = y + height // 2
 
-            cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            cropped_image = image[y1:y2, x1:x2]
-            cropped_path = f"cropped_img.jpg"
-            cv2.imwrite(cropped_path, cropped_image)
+            cv2.rectangle(labeled, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            cropped_image = labeled[y1:y2, x1:x2]
+            frame_archiver.save("cropped_img.jpg", cropped_image.copy(), timestamped=False)
     print("Confidence ", confidence)
-    ocr(filepath)
-    cv2.imwrite("Labeled_Result.jpg", image)
+    ocr(image)
+    frame_archiver.save("Labeled_Result.jpg", labeled, timestamped=False)
     return True
 
 def handle_rfid():
     global rfid_tag
-    max_attempts = 5
-    attempt = 0
-
-    while attempt < max_attempts:
-        rfid_result = rfidReader.read_response()
-        if rfid_result:
-            print(f"RFID found: {rfid_result}")
-            rfid_tag = rfid_result
-            return True
-        print(f"RFID read failed, retrying... ({attempt + 1}/{max_attempts})")
-        attempt += 1
-        time.sleep(1)
+    since = time.monotonic() - RFID_LOOKBACK
+    tag = rfidReader.wait_for_tag(timeout=RFID_TIMEOUT, since=since)
+    if tag:
+        # Several tags may be in range, take the strongest one read for this vehicle
+        best = rfidHandler.best_candidate(since)
+        rfid_tag = best.tag_number if best else tag.tag_number
+        print(f"RFID found: {rfid_tag}")
+        return True
 
     print("RFID not found.")
     return False
 
-def process_detection(file_path):
+def process_detection(image):
     if handle_rfid():
         print("Detecting Plate Number...")
-        detectPlateNumber(file_path)
+        detectPlateNumber(image)
     else:
         print("RFID detection failed.")
 
@@ -161,15 +170,23 @@ def upload_file():
     file = request.files['file']
     if file.filename == '':
         return 'No selected file', 400
-    file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(file_path)
+    jpeg = file.read()
+    image = decode_jpeg(jpeg)
+    if image is None:
+        return 'File is not an image', 400
+    frame_archiver.save(file.filename, jpeg)
 
     # Process the detection
-    process_detection(file_path)
+    process_detection(image)
     return f"File {file.filename} uploaded successfully!", 200
 
 def main():
     try:
+        rfidReader.on_tag_read(rfidHandler.handle_tag)
+        if RFID_EPC_PREFIX:
+            rfidReader.set_epc_filters(rfid.EPCFilter.prefix(RFID_EPC_PREFIX))
+        rfidReader.start_inventory()
+        rfidReader.start_reading()
         app.run(host='0.0.0.0', port=5000)
     except KeyboardInterrupt:
         print("Program stopped by user")
@@ -4,16 +4,22 @@ import requests
 import threading
 import RPi.GPIO as GPIO
 import time
-import cv2
 import sqlite3
 import re
 from inference_sdk import InferenceHTTPClient
 import rfid
+from frameArchiver import FrameArchiver, decode_jpeg
+from uploadRequest import keep_uploads_in_memory
 
 # Flask app setup
 app = Flask(__name__)
+keep_uploads_in_memory(app)  # Frames are too big for Werkzeug's in-memory limit
 UPLOAD_FOLDER = '/home/pi/Desktop/Uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Uploads are decoded in memory; copies are written here in the background, False to skip
+ARCHIVE_FRAMES = True
+ARCHIVE_MAX_FILES = 200  # Oldest timestamped copies are deleted past this, about 80 MB of frames
+frame_archiver = FrameArchiver(UPLOAD_FOLDER if ARCHIVE_FRAMES else None, max_files=ARCHIVE_MAX_FILES)
 
 # GPIO setup
 IR_SENSOR_PIN = 4
@@ -74,17 +80,15 @@ def search_db(plate):
         print("No matching plate found.")
         return None
 
-def detect_plate_number(filepath):
-    result = CLIENTPLATE.infer(filepath, model_id="plate-detection-svkgg/1")
-    image = cv2.imread(filepath)
+def detect_plate_number(image):
+    result = CLIENTPLATE.infer(image, model_id="plate-detection-svkgg/1")
     if "predictions" in result:
         for prediction in result["predictions"]:
             x, y, width, height = map(int, (prediction["x"], prediction["y"], prediction["width"], prediction["height"]))
             x1, y1, x2, y2 = x - width // 2, y - height // 2, x + width // 2, y + height // 2
             cropped_image = image[y1:y2, x1:x2]
-            cropped_path = "cropped_img.jpg"
-            cv2.imwrite(cropped_path, cropped_image)
-            result = CLIENT.ocr_image(inference_input=cropped_path)
+            frame_archiver.save("cropped_img.jpg", cropped_image, timestamped=False)
+            result = CLIENT.ocr_image(inference_input=cropped_image)
             plate = extract_plate_number(result)
             print("Detected Plate:", plate)
             if plate:
@@ -111,10 +115,13 @@ def upload_file():
     file = request.files['file']
     if file.filename == '':
         return 'No selected file', 400
-    file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(file_path)
+    jpeg = file.read()
+    image = decode_jpeg(jpeg)
+    if image is None:
+        return 'File is not an image', 400
+    frame_archiver.save(file.filename, jpeg)
     print(f"File {file.filename} uploaded successfully.")
-    detect_plate_number(file_path)
+    detect_plate_number(image)
     return f"File {file.filename} processed successfully!", 200
 
 # Main function
@@ -1,22 +1,27 @@
 from flask import Flask, Response, render_template_string, request
-import os
-import cv2
 import threading
-import requests
-import time
+from camera import CameraHandler, FrameBroadcaster
+from frameUploader import FrameUploader, REJECTED
 from datetime import datetime, timedelta
 
 # Flask app setup
 app = Flask(__name__)
 
 # Webcam setup (use 0 for default camera)
-camera = cv2.VideoCapture(0)
-camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)  # Width
-camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)  # Height
+camera_handler = CameraHandler(0, width=1920, height=1080)
+# Frames are JPEG encoded once and shared by every /video_feed client. The page shows
+# the stream at most 800 px wide, full resolution frames are only used for captures.
+PREVIEW_WIDTH = 800
+PREVIEW_FPS = 15
+PREVIEW_QUALITY = 70
+frame_broadcaster = FrameBroadcaster(camera_handler, width=PREVIEW_WIDTH, fps=PREVIEW_FPS,
+                                     quality=PREVIEW_QUALITY)
 
 # Upload URL (Raspberry Pi)
 UPLOAD_URL = "http://192.168.18.92:5000/upload"  # Replace with actual Raspberry Pi IP
-FRAME_PATH = "frame.jpg"  # Temporary storage for the captured frame
+ARCHIVE_DIR = None  # Directory to also keep every sent frame in, None to never touch the disk
+SPOOL_DIR = 'upload_spool'  # Uploads the Pi has not taken yet wait here once the memory queue is full
+frame_uploader = FrameUploader(UPLOAD_URL, archive_dir=ARCHIVE_DIR, spool_dir=SPOOL_DIR)
 
 # Trigger control variables
 TRIGGER_COOLDOWN = 5  # Cooldown period in seconds
@@ -34,52 +39,10 @@ def is_trigger_allowed():
             return True
         return False
 
-# Function to generate video frames
-def generate_frames():
-    global frame
-    while True:
-        success, frame = camera.read()  # Capture frame from the camera
-        if not success:
-            break
-        else:
-            # Encode the frame in JPEG format
-            _, buffer = cv2.imencode('.jpg', frame)
-            frame = buffer.tobytes()
-            # Yield the frame as part of an HTTP response
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-
-def safe_write_frame(frame_data):
-    """Safely write frame data to file with proper cleanup"""
-    temp_path = f"{FRAME_PATH}.temp"
-    try:
-        # Write to temporary file first
-        with open(temp_path, 'wb') as f:
-            f.write(frame_data)
-        # Then rename it to the actual file (atomic operation)
-        os.replace(temp_path, FRAME_PATH)
-    except Exception as e:
-        print(f"Error writing frame: {e}")
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        raise
-    
-def send_frame_to_raspberry():
-    """Send the captured frame to Raspberry Pi"""
-    try:
-        with open(FRAME_PATH, 'rb') as f:
-            files = {'file': f}
-            response = requests.post(UPLOAD_URL, files=files, timeout=5)
-            print(f"Frame sent successfully: {response.text}")
-            return True
-    except Exception as e:
-        print(f"Failed to send frame: {e}")
-        return False
-    
 # Route for the video feed
 @app.route('/video_feed')
 def video_feed():
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return Response(frame_broadcaster.generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 # Main route to display the video and handle manual control
 @app.route('/', methods=['GET', 'POST'])
@@ -173,7 +136,6 @@ def index():
 # Route to handle trigger from Raspberry Pi
 @app.route('/trigger', methods=['POST'])
 def handle_trigger():
-    global frame
     data = request.json
     
     if data.get('trigger') == 'object_detected':
@@ -185,20 +147,12 @@ def handle_trigger():
         
         print("Trigger received from Raspberry Pi: Object detected!")
         
+        frame = camera_handler.get_jpeg_frame()
         if frame is not None:
-            try:
-                # Write frame to file
-                safe_write_frame(frame)
-                
-                # Send frame in a separate thread to avoid blocking
-                thread = threading.Thread(target=send_frame_to_raspberry)
-                thread.daemon = True
-                thread.start()
-                
-                return "Trigger processed", 200
-            except Exception as e:
-                print(f"Error processing trigger: {e}")
-                return "Error processing trigger", 500
+            # Queued in memory, or on disk while the Pi is behind
+            if frame_uploader.submit([('camera', frame)]) == REJECTED:
+                return "Upload queue full", 503
+            return "Trigger processed", 200
         else:
             return "No frame available", 400
             
@@ -206,8 +160,13 @@ def handle_trigger():
 
 # Start Flask app
 if __name__ == '__main__':
-    frame = None
-    # Ensure the frame file doesn't exist at startup
-    if os.path.exists(FRAME_PATH):
-        os.remove(FRAME_PATH)
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    try:
+        camera_handler.initialize()
+        frame_broadcaster.start()
+        frame_uploader.start()
+        # The reloader would run this block again in a child process, so two
+        # uploaders would deliver from the same spool
+        app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
+    finally:
+        # Uploads still queued in memory go to the spool for the next start
+        frame_uploader.close()
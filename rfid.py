@@ -1,172 +1,779 @@
 import serial
-import binascii
 import time
+import threading
+import selectors
+import heapq
+import itertools
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from concurrent.futures import Future
+from contextlib import nullcontext
 from dataclasses import dataclass
 from typing import Optional, List, Any
 
-class ExpiringDict(dict):
-    def __init__(self, default_expiry: int = 3600, *args, **kwargs):
+FRAME_HEADER = b'RF'
+FRAME_HEADER_LENGTH = 8  # header(2) + frame_type(1) + address(2) + frame_code(1) + param_length(2)
+MAX_PARAM_LENGTH = 1024  # Anything longer is treated as a false header match
+READ_TIMEOUT = 0.1  # Serial read timeout used by the reader thread, bounds how long stop() waits
+COMMAND_TIMEOUT = 2.0  # Seconds a command waits for its response before its future fails
+REOPEN_DELAY = 1.0  # First wait before a ReaderPool reopens a failed reader, doubled up to MAX_REOPEN_DELAY
+MAX_REOPEN_DELAY = 30.0
+
+# Single parameter types (TLV 0x26) for the set/query parameter commands
+PARAM_POWER = 0x01  # 2 bytes, hundredths of a dBm, max 3000
+PARAM_BUZZER = 0x02  # 1 byte, 1 on, 0 off
+PARAM_FILTER_TIME = 0x03  # 1 byte, seconds the reader suppresses repeat reads of a tag
+PARAM_MODEM = 0x04  # Mixer gain, IF amp gain, 2 byte signal threshold
+
+STATUS_MESSAGES = {
+    0x00: "Success",
+    0x14: "Parameter unsupported",
+    0x15: "Parameter length error",
+    0x16: "Parameter content error",
+    0x17: "Unsupported command",
+    0x18: "Device address error",
+    0x20: "Checksum error",
+    0x21: "Unsupported TLV type",
+    0x22: "Flash error",
+    0xFF: "Internal error",
+}
+
+
+class EPCFilter:
+    """Match tags on a bit range of the EPC, like a Gen2 select mask on the EPC bank
+
+    The reader's protocol has no select command, so matching happens as soon as a
+    notification is decoded, before callbacks, history and aggregation see the tag.
+    """
+
+    def __init__(self, mask: str, offset: int = 0, length: Optional[int] = None,
+                 epc_length: Optional[int] = None):
+        """`mask` is hex, `offset` and `length` are in bits from the start of the EPC
+
+        With `epc_length` (bits) set, only EPCs of exactly that length match.
+        """
+        mask_bits = len(mask) * 4
+        self.offset = offset
+        self.length = length if length is not None else mask_bits
+        if offset < 0 or not 0 < self.length <= mask_bits:
+            raise ValueError(f"EPC filter needs 0 < length <= {mask_bits} bits of mask "
+                             f"and offset >= 0, got length {self.length}, offset {offset}")
+        self.epc_length = epc_length
+        self.mask = int(mask, 16) >> (mask_bits - self.length)
+
+    @classmethod
+    def prefix(cls, prefix: str) -> 'EPCFilter':
+        return cls(prefix)
+
+    @classmethod
+    def exact(cls, tag_number: str) -> 'EPCFilter':
+        return cls(tag_number, epc_length=len(tag_number) * 4)
+
+    def matches(self, epc: str) -> bool:
+        bits = len(epc) * 4
+        if self.epc_length is not None and bits != self.epc_length:
+            return False
+        end = self.offset + self.length
+        if end > bits:
+            return False
+        return (int(epc, 16) >> (bits - end)) & ((1 << self.length) - 1) == self.mask
+
+
+class RFIDCommandError(Exception):
+    """The reader rejected a command or did not answer it in time"""
+
+    def __init__(self, frame_code: int, status: Optional[int], message: Optional[str] = None):
+        self.frame_code = frame_code
+        self.status = status
+        if message is None:
+            message = STATUS_MESSAGES.get(status, f"Status 0x{status:02X}")
+        super().__init__(f"Command 0x{frame_code:02X} failed: {message}")
+
+class ExpiringDict(MutableMapping):
+    """Dict whose entries expire after a timeout
+
+    Deadlines are kept in a min-heap so cleanup only touches expired entries.
+    With max_size set, the least recently used entry is evicted when full.
+    Pass thread_safe=True to guard every operation with a lock.
+    """
+
+    def __init__(self, default_expiry: int = 3600, *args, max_size: Optional[int] = None,
+                 thread_safe: bool = False, **kwargs):
         self.default_expiry = default_expiry
-        self._expiry = {}
-        super().__init__(*args, **kwargs)
+        self.max_size = max_size
+        self._data = OrderedDict()  # key -> (value, deadline), least recently used first
+        self._heap = []  # (deadline, counter, key), may hold stale entries
+        self._counter = itertools.count()
+        self._lock = threading.RLock() if thread_safe else nullcontext()
+        self.update(*args, **kwargs)
     
     def __setitem__(self, key: str, value: Any, expiry: Optional[int] = None) -> None:
-        super().__setitem__(key, value)
-        self._expiry[key] = time.time() + (expiry or self.default_expiry)
-        self.cleanup() # Auto cleanup expired items
+        now = time.monotonic()
+        deadline = now + (expiry if expiry is not None else self.default_expiry)
+        with self._lock:
+            self._expire(now)
+            self._data[key] = (value, deadline)
+            self._data.move_to_end(key)
+            heapq.heappush(self._heap, (deadline, next(self._counter), key))
+            if self.max_size is not None:
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+            if len(self._heap) > 2 * len(self._data) + 64:
+                self._compact()
     
     def __getitem__(self, key: str) -> Any:
-        expiry = self._expiry.get(key, 0)
-        if expiry < time.time():
-            del self[key]
-            return None
-        return super().__getitem__(key)
+        with self._lock:
+            value, deadline = self._data[key]
+            if deadline <= time.monotonic():
+                del self._data[key]
+                raise KeyError(key)
+            self._data.move_to_end(key)
+            return value
     
     def __delitem__(self, key: str) -> None:
-        super().__delitem__(key)
-        self._expiry.pop(key, None)
+        with self._lock:
+            del self._data[key]
+
+    def __contains__(self, key: object) -> bool:
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[1] > time.monotonic()
+
+    def __iter__(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return iter(list(self._data))
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire(time.monotonic())
+            return len(self._data)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
     
     def set(self, key: str, value: Any, expiry: Optional[int] = None) -> None:
         self.__setitem__(key, value, expiry)
         
     def cleanup(self) -> None:
-        now = time.time()
-        expired = [k for k, exp in self._expiry.items() if exp < now]
-        for k in expired:
-            del self[k]
+        with self._lock:
+            self._expire(time.monotonic())
+
+    def _expire(self, now: float) -> None:
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(heap)
+            entry = self._data.get(key)
+            # Skip heap entries left behind by overwrites, deletes and evictions
+            if entry is not None and entry[1] == deadline:
+                del self._data[key]
+
+    def _compact(self) -> None:
+        self._heap = [(deadline, next(self._counter), key) for key, (_, deadline) in self._data.items()]
+        heapq.heapify(self._heap)
 
-@dataclass
 class RFIDTag:
-    epc: str
-    rssi: int
-    timestamp: int
-    tlv_data: List[bytes] = None
+    """One tag read, kept compact since the reader can report hundreds per second"""
+    __slots__ = ('epc', 'rssi', 'timestamp', 'received_at', 'lane')
+
+    def __init__(self, epc: str = "", rssi: int = 0, timestamp: int = 0, received_at: float = 0.0,
+                 lane: Optional[str] = None):
+        self.epc = epc  # Hex of the EPC TLV value
+        self.rssi = rssi
+        self.timestamp = timestamp
+        self.received_at = received_at  # Host time.monotonic() when the frame was decoded
+        self.lane = lane  # Lane/reader id of the reader that saw the tag
+
+    def __repr__(self):
+        return (f"RFIDTag(epc={self.epc!r}, rssi={self.rssi}, timestamp={self.timestamp}, "
+                f"received_at={self.received_at}, lane={self.lane!r})")
+
+    @property
+    def tag_number(self) -> str:
+        """Tag number as stored in the vehicle table"""
+        return self.epc.upper()
+
+
+def _decode_epc(tag: RFIDTag, value: memoryview) -> None:
+    tag.epc = value.hex()
+
+def _decode_rssi(tag: RFIDTag, value: memoryview) -> None:
+    tag.rssi = int.from_bytes(value, 'big')
+
+def _decode_timestamp(tag: RFIDTag, value: memoryview) -> None:
+    tag.timestamp = int.from_bytes(value, 'big')
+
+def _decode_single_tag(tag: RFIDTag, value: memoryview) -> None:
+    decode_tlvs(tag, value)  # Single Tag TLV nests the EPC, RSSI and time TLVs
+
+# Tag notification TLV type -> decoder
+TLV_DECODERS = {
+    0x01: _decode_epc,
+    0x05: _decode_rssi,
+    0x06: _decode_timestamp,
+    0x50: _decode_single_tag,
+}
+
+def decode_tlvs(tag: RFIDTag, tlv_data: memoryview) -> None:
+    """Decode TLVs into `tag` without copying the values"""
+    end = len(tlv_data)
+    i = 0
+    while i < end:
+        tag_type = tlv_data[i]
+        length = tlv_data[i + 1]
+        decoder = TLV_DECODERS.get(tag_type)
+        if decoder is not None:
+            decoder(tag, tlv_data[i + 2:i + 2 + length])
+        i += 2 + length
+
+def parse_tlvs(data: bytes) -> dict:
+    """Split top level TLVs into a type -> value dict"""
+    tlvs = {}
+    i = 0
+    while i + 1 < len(data):
+        length = data[i + 1]
+        tlvs[data[i]] = bytes(data[i + 2:i + 2 + length])
+        i += 2 + length
+    return tlvs
+
+def calculate_checksum(data: bytes) -> int:
+    return -sum(data) & 0xFF
+
+def build_frame(frame_type: int, frame_code: int, parameters: bytes = b'', address: bytes = b'\x00\x00') -> bytes:
+    frame = FRAME_HEADER + bytes([frame_type]) + address + bytes([frame_code]) + \
+            len(parameters).to_bytes(2, 'big') + parameters
+    return frame + bytes([calculate_checksum(frame)])
+
 
 class RFIDReader:
-    def __init__(self, port='/dev/ttyUSB0', baudrate=115200):
-        self.serial_port = serial.Serial(port, baudrate)
+    def __init__(self, port='/dev/ttyUSB0', baudrate=115200, lane: Optional[str] = None):
+        # Also accepts pyserial URLs such as loop:// for testing without the reader
+        self.serial_port = serial.serial_for_url(port, baudrate)
         self.tag_callback = None
         self.port = port
         self.baudrate = baudrate
+        self.lane = lane
+        self.tags_read = 0
+        self.epc_filters = []  # Only tags matching one of these are reported, if any are set
+        self.tags_filtered = 0
+        self.recorder = None  # Optional rfidRecorder.RawReadRecorder, gets every read before filtering
+        # Receive buffer, partial frames are kept here between reads
+        self._rx_buffer = bytearray()
+        self.frames_parsed = 0
+        self.checksum_errors = 0
+        self.bytes_skipped = 0
+        # Background reader thread state
+        self._reader_thread = None
+        self._reading = False
+        self._tag_condition = threading.Condition()
+        self._tag_history = deque(maxlen=256)
+        # Commands waiting for their response, frame code -> deque of (deadline, future, expected TLV)
+        self._pending_commands = {}
+        self._command_lock = threading.Lock()
         
     def calculate_checksum(self, data: bytes) -> int:
-        checksum = 0
-        for byte in data:
-            checksum += byte
-        return (~checksum + 1) & 0xFF
+        return calculate_checksum(data)
 
     def start_serial(self):
-        self.serial_port = serial.Serial(self.port, self.baudrate)
+        self.serial_port = serial.serial_for_url(self.port, self.baudrate)
+        self._rx_buffer.clear()
     
     def create_command(self, frame_code: int, parameters: bytes = b'') -> bytes:
-        address = b'\x00\x00'  # Default address
-        param_length = len(parameters).to_bytes(2, 'big')
-        
-        frame = b'RF' + b'\x00' + address + bytes([frame_code]) + param_length + parameters
-        checksum = self.calculate_checksum(frame)
-        return frame + bytes([checksum])
+        return build_frame(0x00, frame_code, parameters)
     
     def parse_tag_notification(self, data: bytes) -> Optional[RFIDTag]:
         try:
-            # Skip header(2) + frame_type(1) + address(2) + frame_code(1) + param_length(2)
-            tlv_data = data[8:-1]  # Exclude checksum
+            # Skip header + frame_type + address + frame_code + param_length, exclude checksum
+            tlv_data = memoryview(data)[FRAME_HEADER_LENGTH:-1]
             
-            # Parse TLV structure
-            tag = RFIDTag(epc="", rssi=0, timestamp=0, tlv_data=tlv_data)
-            i = 0
-            while i < len(tlv_data):
-                tag_type = tlv_data[i]
-                length = tlv_data[i + 1]
-                value = tlv_data[i + 2:i + 2 + length]
-                
-                if tag_type == 0x01:  # EPC
-                    tag.epc = binascii.hexlify(value).decode('ascii')
-                elif tag_type == 0x05:  # RSSI
-                    tag.rssi = int.from_bytes(value, 'big')
-                elif tag_type == 0x06:  # Timestamp
-                    tag.timestamp = int.from_bytes(value, 'big')
-                    
-                i += 2 + length
-                
+            tag = RFIDTag()
+            decode_tlvs(tag, tlv_data)
             return tag
         except Exception as e:
             print(f"Error parsing tag notification: {e}")
             return None
 
-    def start_inventory(self):
-        # Send start inventory command
-        command = self.create_command(0x21)
-        # command = self.create_command(0x22)
-        print(f"start_inventory: {binascii.hexlify(command)}")
-        self.serial_port.write(command)
-        
-    def stop_inventory(self):
-        # Send stop inventory command
-        command = self.create_command(0x23)
-        print(f"stop_inventory: {binascii.hexlify(command)}")
-        self.serial_port.write(command)
-
-    def read_response(self):
-        # print("read repsonse")
-        if self.serial_port.in_waiting >= 8:  # Minimum frame size
-            # Read header
-            header = self.serial_port.read(2)
-            if header == b'RF':
-                frame_type = ord(self.serial_port.read(1))
-                address = self.serial_port.read(2)
-                frame_code = ord(self.serial_port.read(1))
-                param_length = int.from_bytes(self.serial_port.read(2), 'big')
-                
-                # Read parameters and checksum
-                remaining_data = self.serial_port.read(param_length + 1)
-                
-                if frame_type == 0x02 and frame_code == 0x80:  # Tag notification
-                    full_frame = header + bytes([frame_type]) + address + bytes([frame_code]) + \
-                                param_length.to_bytes(2, 'big') + remaining_data
-                    
-                    tag = self.parse_tag_notification(full_frame)
-                    if tag and self.tag_callback:
-                        self.tag_callback(tag)
-                        return True
-
-        elif self.serial_port.in_waiting > 0:
-            data = self.serial_port.read(self.serial_port.in_waiting)
-            print(f"Leftover data: {binascii.hexlify(data)}, length = {len(data)}")
-            return True
-        
-        return False
+    def send_command(self, frame_code: int, parameters: bytes = b'',
+                     timeout: float = COMMAND_TIMEOUT, expect: Optional[int] = None) -> Future:
+        """Write a command and return a Future for its response
+
+        The future resolves to the response TLVs (type -> value) when the matching
+        response frame is read, or fails with RFIDCommandError on an error status,
+        a response missing the `expect` TLV, or no response within `timeout`.
+        Responses and timeouts are only seen while something reads the port
+        (start_reading, a ReaderPool or read_response), and tag notifications keep
+        flowing meanwhile.
+        """
+        future = Future()
+        command = self.create_command(frame_code, parameters)
+        with self._command_lock:
+            self._pending_commands.setdefault(frame_code, deque()).append(
+                (time.monotonic() + timeout, future, expect))
+            self.serial_port.write(command)
+        return future
+
+    def expire_commands(self, now: Optional[float] = None) -> None:
+        """Fail pending commands whose response did not arrive before their deadline"""
+        if not self._pending_commands:
+            return
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self._command_lock:
+            for frame_code, pending in list(self._pending_commands.items()):
+                live = deque()
+                for entry in pending:
+                    if entry[1].done():
+                        continue
+                    if entry[0] < now:
+                        expired.append((frame_code, entry[1]))
+                    else:
+                        live.append(entry)
+                if live:
+                    self._pending_commands[frame_code] = live
+                else:
+                    del self._pending_commands[frame_code]
+        for frame_code, future in expired:
+            if not future.done():
+                future.set_exception(RFIDCommandError(frame_code, None, "Timed out"))
+
+    def _resolve_command(self, frame: bytes) -> None:
+        frame_code = frame[5]
+        self.expire_commands()
+        with self._command_lock:
+            pending = self._pending_commands.get(frame_code)
+            if not pending:
+                return
+            _, future, expect = pending.popleft()
+            if not pending:
+                del self._pending_commands[frame_code]
+        tlvs = parse_tlvs(memoryview(frame)[FRAME_HEADER_LENGTH:-1])
+        status = tlvs.get(0x07, b'\x00')
+        if not status:
+            future.set_exception(RFIDCommandError(frame_code, None, "Empty status TLV"))
+        elif status[0] != 0x00:
+            future.set_exception(RFIDCommandError(frame_code, status[0]))
+        elif expect is not None and not tlvs.get(expect):
+            future.set_exception(RFIDCommandError(frame_code, None, f"Response has no TLV 0x{expect:02X}"))
+        else:
+            future.set_result(tlvs)
+
+    def set_epc_filters(self, *filters: EPCFilter) -> None:
+        """Report only tags matching one of `filters`, call without arguments to report all"""
+        self.epc_filters = list(filters)
+
+    def inventory_once(self) -> None:
+        """Run a single inventory round, the reader answers with tag notifications only"""
+        self.serial_port.write(self.create_command(0x22))
+
+    def start_inventory(self) -> Future:
+        return self.send_command(0x21)
         
-        # print("Exiting read_response loop")
+    def stop_inventory(self) -> Future:
+        return self.send_command(0x23)
+
+    def query_version(self) -> Future:
+        """Future resolving to the firmware version as a (main, sub, modify) tuple"""
+        return self._chain(self.send_command(0x40, expect=0x20), lambda tlvs: tuple(tlvs[0x20]))
+
+    def set_parameter(self, param_type: int, value: bytes) -> Future:
+        return self.send_command(0x48, bytes([0x26, len(value) + 1, param_type]) + value)
+
+    def query_parameter(self, param_type: int) -> Future:
+        """Future resolving to the raw value of a single parameter"""
+        return self._chain(self.send_command(0x49, bytes([0x26, 1, param_type]), expect=0x26),
+                           lambda tlvs: tlvs[0x26][1:])
+
+    def set_power(self, dbm: float) -> Future:
+        """Set RF output power, up to 30 dBm"""
+        return self.set_parameter(PARAM_POWER, round(dbm * 100).to_bytes(2, 'big'))
+
+    def query_power(self) -> Future:
+        """Future resolving to the RF output power in dBm"""
+        return self._chain(self.query_parameter(PARAM_POWER),
+                           lambda value: int.from_bytes(value, 'big') / 100)
+
+    def set_filter_time(self, seconds: int) -> Future:
+        """Set how long (1-255 s) the reader suppresses repeat reads of the same tag"""
+        return self.set_parameter(PARAM_FILTER_TIME, bytes([seconds]))
+
+    def set_modem(self, mixer_gain: int = 9, if_gain: int = 36, threshold: int = 0x00A0) -> Future:
+        """Set receiver gains and signal threshold, a higher threshold shortens read range"""
+        return self.set_parameter(PARAM_MODEM, bytes([mixer_gain, if_gain]) + threshold.to_bytes(2, 'big'))
+
+    def set_buzzer(self, on: bool) -> Future:
+        return self.set_parameter(PARAM_BUZZER, bytes([1 if on else 0]))
+
+    @staticmethod
+    def _chain(future: Future, convert) -> Future:
+        result = Future()
+
+        def done(source):
+            try:
+                result.set_result(convert(source.result()))
+            except Exception as e:
+                result.set_exception(e)
+
+        future.add_done_callback(done)
+        return result
+
+    def read_frames(self, block: bool = False) -> List[bytes]:
+        """Read everything pending on the port and return all complete frames
+
+        With block=True wait (up to the port timeout) for at least one byte first.
+        """
+        if block:
+            self._rx_buffer += self.serial_port.read(1)
+        waiting = self.serial_port.in_waiting
+        if waiting:
+            self._rx_buffer += self.serial_port.read(waiting)
+        return self._extract_frames()
+
+    def _extract_frames(self) -> List[bytes]:
+        buffer = self._rx_buffer
+        view = memoryview(buffer)
+        end = len(buffer)
+        frames = []
+        pos = 0
+        while end - pos > FRAME_HEADER_LENGTH:
+            if buffer[pos] != 0x52 or buffer[pos + 1] != 0x46:  # Not 'RF', resync
+                next_header = buffer.find(FRAME_HEADER, pos + 1)
+                if next_header < 0:
+                    # Keep a trailing 'R', it may be the start of the next header
+                    next_header = end - 1 if buffer[end - 1] == 0x52 else end
+                self.bytes_skipped += next_header - pos
+                pos = next_header
+                continue
+
+            param_length = (buffer[pos + 6] << 8) | buffer[pos + 7]
+            if param_length > MAX_PARAM_LENGTH:
+                self.bytes_skipped += 1
+                pos += 1
+                continue
+
+            frame_end = pos + FRAME_HEADER_LENGTH + param_length + 1
+            if frame_end > end:
+                break  # Partial frame, wait for the rest
+
+            frame = bytes(view[pos:frame_end])
+            if sum(frame) & 0xFF:  # Valid frames sum to zero including the checksum
+                self.checksum_errors += 1
+                self.bytes_skipped += 1
+                pos += 1
+                continue
+
+            frames.append(frame)
+            self.frames_parsed += 1
+            pos = frame_end
+
+        view.release()  # The buffer can't be resized while a view is exported
+        if pos:
+            del buffer[:pos]
+        return frames
+
+    def _decode_tags(self, frames: List[bytes]) -> List[RFIDTag]:
+        """Decode tag notifications and hand command responses to their futures"""
+        tags = []
+        decoded = [] if self.recorder is not None else None
+        for frame in frames:
+            if frame[2] == 0x02 and frame[5] == 0x80:  # Tag notification
+                tag = self.parse_tag_notification(frame)
+                if not tag:
+                    continue
+                tag.received_at = time.monotonic()
+                tag.lane = self.lane
+                if decoded is not None:
+                    decoded.append(tag)
+                if self.epc_filters and not any(f.matches(tag.epc) for f in self.epc_filters):
+                    self.tags_filtered += 1
+                    continue
+                tags.append(tag)
+            elif frame[2] == 0x01 and frame[5] in self._pending_commands:
+                # Response frame; type 0x00 is a command, e.g. our own echo on a loopback port
+                self._resolve_command(frame)
+        if decoded:
+            self.recorder.record_many(decoded)
+        return tags
+
+    def _publish(self, tags: List[RFIDTag]) -> None:
+        if not tags:
+            return
+        self.tags_read += len(tags)
+        # Run callbacks first so waiters see up to date handler state
+        if self.tag_callback:
+            for tag in tags:
+                try:
+                    self.tag_callback(tag)
+                except Exception as e:  # The other tags and the history still get the read
+                    print(f"Error in RFID tag callback: {e}")
+        with self._tag_condition:
+            self._tag_history.extend(tags)
+            self._tag_condition.notify_all()
+
+    def read_response(self) -> List[RFIDTag]:
+        """Parse all pending frames and pass every tag notification to the callback"""
+        tags = self._decode_tags(self.read_frames())
+        self._publish(tags)
+        self.expire_commands()
+        return tags
+
+    def start_reading(self):
+        """Start the background thread that reads tags into the tag history"""
+        if self._reading:
+            return
+        self.serial_port.timeout = READ_TIMEOUT
+        self._reading = True
+        self._reader_thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader_thread.start()
+
+    def stop_reading(self):
+        self._reading = False
+        if self._reader_thread is not None:
+            self._reader_thread.join()
+            self._reader_thread = None
+
+    def _read_loop(self):
+        while self._reading:
+            try:
+                self._publish(self._decode_tags(self.read_frames(block=True)))
+                self.expire_commands()
+            except serial.SerialException as e:
+                print(f"Error reading RFID: {e}")
+                time.sleep(READ_TIMEOUT)
+            except Exception as e:  # E.g. from a tag callback, the thread must keep reading
+                print(f"Error handling RFID read: {e}")
+
+    def recent_tags(self, since: Optional[float] = None) -> List[RFIDTag]:
+        """Return tags received at or after `since` (time.monotonic()), oldest first"""
+        with self._tag_condition:
+            if since is None:
+                return list(self._tag_history)
+            return [tag for tag in self._tag_history if tag.received_at >= since]
+
+    def wait_for_tag(self, timeout: Optional[float] = None, since: Optional[float] = None) -> Optional[RFIDTag]:
+        """Block until a tag received at or after `since` is available and return it
+
+        `since` defaults to now. Pass an earlier time.monotonic() value so tags read
+        just before the trigger are returned immediately. Returns None on timeout.
+        """
+        if since is None:
+            since = time.monotonic()
+        with self._tag_condition:
+            found = self._tag_condition.wait_for(
+                lambda: self._tag_history and self._tag_history[-1].received_at >= since,
+                timeout)
+            if not found:
+                return None
+            for tag in self._tag_history:
+                if tag.received_at >= since:
+                    return tag
 
     def on_tag_read(self, callback):
         """Set callback function to be called when a tag is read"""
         self.tag_callback = callback
 
 
+class ReaderPool:
+    """Serve several readers (lanes or antennas) from a single selector thread
+
+    Each reader keeps its own callback and tag history, so wait_for_tag and
+    TagHandler work per lane exactly as with a reader running its own thread.
+    A reader whose port fails is closed and reopened with backoff while the
+    other lanes keep reading.
+    """
+
+    def __init__(self):
+        self.readers = {}  # lane -> RFIDReader
+        self._parked = {}  # lane -> (time.monotonic() of the next reopen attempt, delay) of failed readers
+        self._selector = selectors.DefaultSelector()
+        self._thread = None
+        self._running = False
+        self._last_stats = {}  # lane -> (time.monotonic(), tags_read) at the last stats() call
+
+    def add_reader(self, lane: str, reader: RFIDReader, callback=None) -> RFIDReader:
+        reader.lane = lane
+        if callback is not None:
+            reader.on_tag_read(callback)
+        self.readers[lane] = reader
+        self._last_stats[lane] = (time.monotonic(), reader.tags_read)
+        self._selector.register(reader.serial_port.fileno(), selectors.EVENT_READ, reader)
+        return reader
+
+    def open_reader(self, lane: str, port: str, baudrate: int = 115200, callback=None) -> RFIDReader:
+        return self.add_reader(lane, RFIDReader(port, baudrate, lane=lane), callback)
+
+    def remove_reader(self, lane: str) -> None:
+        reader = self.readers.pop(lane)
+        self._last_stats.pop(lane, None)
+        if self._parked.pop(lane, None) is None:
+            self._selector.unregister(reader.serial_port.fileno())
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        while self._running:
+            for key, _ in self._selector.select(timeout=READ_TIMEOUT):
+                reader = key.data
+                try:
+                    reader.read_response()
+                except (serial.SerialException, OSError) as e:
+                    self._park(key.fd, reader, e)
+                except Exception as e:
+                    print(f"Error handling RFID on lane {reader.lane}: {e}")
+            now = time.monotonic()
+            self._reopen(now)
+            # Also fail commands on readers that went quiet
+            for reader in list(self.readers.values()):
+                reader.expire_commands(now)
+
+    def _park(self, fd: int, reader: RFIDReader, error: Exception) -> None:
+        # A hung-up port stays readable, so stop selecting it and reopen it later
+        print(f"Error reading RFID on lane {reader.lane}, reopening in {REOPEN_DELAY:g}s: {error}")
+        self._selector.unregister(fd)
+        try:
+            reader.serial_port.close()
+        except (serial.SerialException, OSError):
+            pass
+        self._parked[reader.lane] = (time.monotonic() + REOPEN_DELAY, REOPEN_DELAY)
+
+    def _reopen(self, now: float) -> None:
+        for lane, (retry_at, delay) in list(self._parked.items()):
+            if now < retry_at:
+                continue
+            reader = self.readers[lane]
+            try:
+                reader.start_serial()
+                self._selector.register(reader.serial_port.fileno(), selectors.EVENT_READ, reader)
+            except (serial.SerialException, OSError) as e:
+                delay = min(delay * 2, MAX_REOPEN_DELAY)
+                self._parked[lane] = (now + delay, delay)
+                print(f"Could not reopen RFID reader on lane {lane}, retrying in {delay:g}s: {e}")
+                continue
+            del self._parked[lane]
+            print(f"Reopened RFID reader on lane {lane}")
+
+    def start_inventory(self) -> None:
+        for reader in self.readers.values():
+            reader.start_inventory()
+
+    def stop_inventory(self) -> None:
+        for reader in self.readers.values():
+            reader.stop_inventory()
+
+    def stats(self) -> dict:
+        """Per-lane counters, with the tag read rate since the previous call"""
+        now = time.monotonic()
+        result = {}
+        for lane, reader in self.readers.items():
+            last_time, last_count = self._last_stats[lane]
+            elapsed = now - last_time
+            result[lane] = {
+                'tags_read': reader.tags_read,
+                'tags_per_second': (reader.tags_read - last_count) / elapsed if elapsed > 0 else 0.0,
+                'frames_parsed': reader.frames_parsed,
+                'checksum_errors': reader.checksum_errors,
+                'bytes_skipped': reader.bytes_skipped,
+                'tags_filtered': reader.tags_filtered,
+                'offline': lane in self._parked,
+            }
+            self._last_stats[lane] = (now, reader.tags_read)
+        return result
+
+
+@dataclass
+class TagStats:
+    """Reads of one tag grouped over the aggregation window"""
+    tag_number: str
+    read_count: int = 0
+    peak_rssi: int = 0
+    rssi_total: int = 0
+    first_seen: float = 0.0
+    last_seen: float = 0.0
+
+    @property
+    def mean_rssi(self) -> float:
+        return self.rssi_total / self.read_count if self.read_count else 0.0
+
+    def add(self, tag: RFIDTag) -> None:
+        if self.read_count == 0:
+            self.first_seen = tag.received_at
+            self.peak_rssi = tag.rssi
+        self.read_count += 1
+        self.peak_rssi = max(self.peak_rssi, tag.rssi)
+        self.rssi_total += tag.rssi
+        self.last_seen = tag.received_at
+
+
 class TagHandler:
-    def __init__(self, lookup, reader: RFIDReader):
+    def __init__(self, lookup, reader: RFIDReader, window: Optional[float] = None):
+        """With `window` set, reads are also aggregated per tag.
+
+        A tag's group is restarted when it has not been read for `window` seconds.
+        """
         self.lookup = lookup
         self.reader = reader
+        self.window = window
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self.repeat_reads = 0  # Reads of tags already in lookup, counted rather than logged
+
+    def _aggregate(self, tag_number: str, tag: RFIDTag) -> None:
+        with self._stats_lock:
+            stats = self.stats.get(tag_number)
+            if stats is None or tag.received_at - stats.last_seen > self.window:
+                stats = self.stats[tag_number] = TagStats(tag_number)
+            stats.add(tag)
+            if len(self.stats) > 256:
+                self._prune(tag.received_at)
+
+    def _prune(self, now: float) -> None:
+        for tag_number in [n for n, s in self.stats.items() if now - s.last_seen > self.window]:
+            del self.stats[tag_number]
+
+    def candidates(self, since: Optional[float] = None, limit: Optional[int] = None) -> List[TagStats]:
+        """Return tags seen at or after `since`, strongest first
+
+        Ordered by peak RSSI, then read count, then mean RSSI, then tag number so
+        the choice is deterministic when several tags are in range.
+        """
+        with self._stats_lock:
+            stats = [s for s in self.stats.values() if since is None or s.last_seen >= since]
+        stats.sort(key=lambda s: (-s.peak_rssi, -s.read_count, -s.mean_rssi, s.tag_number))
+        return stats[:limit]
+
+    def best_candidate(self, since: Optional[float] = None) -> Optional[TagStats]:
+        candidates = self.candidates(since, limit=1)
+        return candidates[0] if candidates else None
 
     def handle_tag(self, tag: RFIDTag):
         """Handle RFID tag detection logic."""
         tag_flag = False
         try:
             # Extract RFID tag number from TLV data
-            rfid_tag_number = binascii.hexlify(tag.tlv_data[0:-2]).decode('utf-8').upper()
-            rfid_tag_number = rfid_tag_number[8:32]
-            self.lookup.cleanup()
-            if self.lookup.get(rfid_tag_number):
-                print("Tag already detected")
+            rfid_tag_number = tag.tag_number
+            if self.window is not None:
+                self._aggregate(rfid_tag_number, tag)
+            if rfid_tag_number in self.lookup:
+                # Streamed reads repeat many times a second while a car waits, only
+                # a new tag (or one whose lookup entry expired) is worth a log line
+                self.repeat_reads += 1
             else:
                 print(f"RFID tag: {rfid_tag_number}")
                 self.lookup[rfid_tag_number] = rfid_tag_number
                 tag_flag = True
-
-            # Reset the reader state
-            self.reader.serial_port.cancel_read()
-            self.reader.serial_port.reset_input_buffer()
-            self.reader.serial_port.reset_output_buffer()
             return tag_flag
 
         except Exception as e:
@@ -183,11 +790,13 @@ if __name__ == "__main__":
     # Set the callback for tag detection
     reader.on_tag_read(handler.handle_tag)    
     reader.start_inventory()
-    while True:
-        try:
-            reader.read_response()
-            time.sleep(0.01)
-        except KeyboardInterrupt:
-            reader.stop_inventory()
-            reader.serial_port.close()
-            break
+    reader.start_reading()
+    try:
+        while True:
+            tag = reader.wait_for_tag(timeout=1)
+            if tag:
+                print(f"EPC: {tag.epc}, RSSI: {tag.rssi}")
+    except KeyboardInterrupt:
+        reader.stop_reading()
+        reader.stop_inventory()
+        reader.serial_port.close()
@@ -0,0 +1,87 @@
+import statistics
+import time
+import rfid
+import rfidSimulator
+
+
+def benchmark_expiring_dict(live_entries=(100, 1000, 10000, 100000), operations=50000):
+    """Measure per-operation cost of ExpiringDict at different numbers of live entries"""
+    print(f"{'live':>8} {'set us/op':>10} {'get us/op':>10} {'in us/op':>10}")
+    for live in live_entries:
+        lookup = rfid.ExpiringDict(default_expiry=3600)
+        for i in range(live):
+            lookup[f"tag{i}"] = i
+
+        keys = [f"tag{i % live}" for i in range(operations)]
+
+        start = time.perf_counter()
+        for key in keys:
+            lookup[key] = key
+        set_cost = (time.perf_counter() - start) / operations * 1e6
+
+        start = time.perf_counter()
+        for key in keys:
+            lookup.get(key)
+        get_cost = (time.perf_counter() - start) / operations * 1e6
+
+        start = time.perf_counter()
+        for key in keys:
+            key in lookup
+        contains_cost = (time.perf_counter() - start) / operations * 1e6
+
+        print(f"{live:>8} {set_cost:>10.2f} {get_cost:>10.2f} {contains_cost:>10.2f}")
+
+
+def benchmark_tag_decoding(count=100000):
+    """Measure the cost of decoding one tag notification frame"""
+    reader = rfid.RFIDReader.__new__(rfid.RFIDReader)  # No serial port needed to decode
+    # Example tag notification from the protocol doc
+    frame = bytes.fromhex('52 46 02 00 00 80 00 19 50 17 01 0C E2 00 00 17 02 17 01 99 23 90 21 7D '
+                          '05 01 C3 06 04 3D 00 00 00 4C')
+
+    start = time.perf_counter()
+    for _ in range(count):
+        reader.parse_tag_notification(frame)
+    cost = (time.perf_counter() - start) / count * 1e6
+    print(f"parse_tag_notification: {cost:.2f} us/tag, {1e6 / cost:,.0f} tags/s")
+
+
+def benchmark_reader(reader_factory=rfid.RFIDReader, rates=(100, 1000, 5000), duration=3.0,
+                     split_ratio=0.2, corrupt_ratio=0.01, junk_ratio=0.01):
+    """Feed a reader from the simulator over a pty and report throughput, drops and latency
+
+    `reader_factory` is called with the pty path, so alternative parsers can be compared.
+    """
+    print(f"{'rate':>6} {'sent':>7} {'parsed/s':>9} {'dropped':>8} {'bad csum':>8} "
+          f"{'p50 ms':>7} {'p99 ms':>7} {'max ms':>7}")
+    for rate in rates:
+        simulator = rfidSimulator.UHFSimulator(rate=rate, split_ratio=split_ratio,
+                                               corrupt_ratio=corrupt_ratio, junk_ratio=junk_ratio, seed=1)
+        reader = reader_factory(simulator.open_pty())
+        latencies = []
+
+        def on_tag(tag):
+            latencies.append(time.monotonic() - simulator.sent_at[tag.timestamp])
+
+        reader.on_tag_read(on_tag)
+        reader.start_reading()
+        simulator.run(duration=duration)
+        time.sleep(0.5)  # Let the reader drain
+        reader.stop_reading()
+        reader.serial_port.close()
+        simulator.close()
+
+        expected = simulator.frames_sent - simulator.frames_corrupted
+        dropped = expected - len(latencies)
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1000 if latencies else 0
+        p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0
+        worst = latencies[-1] * 1000 if latencies else 0
+        print(f"{rate:>6} {simulator.frames_sent:>7} {len(latencies) / duration:>9.0f} {dropped:>8} "
+              f"{reader.checksum_errors:>8} {p50:>7.2f} {p99:>7.2f} {worst:>7.2f}")
+
+
+if __name__ == "__main__":
+    benchmark_expiring_dict()
+    benchmark_tag_decoding()
+    benchmark_reader()
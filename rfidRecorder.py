@@ -0,0 +1,170 @@
+import csv
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import List
+
+
+class _Columns:
+    """Preallocated column buffers for one batch of reads"""
+
+    def __init__(self, capacity: int):
+        self.epc = [None] * capacity
+        self.lane = [None] * capacity
+        self.rssi = array('h', bytes(2 * capacity))
+        self.reader_timestamp = array('Q', bytes(8 * capacity))
+        self.host_time = array('d', bytes(8 * capacity))
+        self.size = 0
+
+    def rows(self, wall_offset: float):
+        for i in range(self.size):
+            yield (self.epc[i], self.rssi[i], self.reader_timestamp[i],
+                   self.host_time[i], self.host_time[i] + wall_offset, self.lane[i])
+
+
+class RawReadRecorder:
+    """Record every tag read to disk without blocking the reader
+
+    Reads are appended to preallocated columns. When a batch fills up, or every
+    flush_interval seconds, it is swapped for an empty one and a background thread
+    writes it out. If the writer falls behind and no empty batch is free, reads are
+    dropped and counted rather than waiting on disk.
+
+    Paths ending in .db or .sqlite go to the raw_reads table, anything else is
+    appended as CSV.
+    """
+
+    COLUMNS = ('epc', 'rssi', 'reader_timestamp', 'host_time', 'wall_time', 'lane')
+
+    def __init__(self, path: str = 'rfid_reads.db', capacity: int = 4096,
+                 flush_interval: float = 1.0, batches: int = 4):
+        self.path = path
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self._free = [_Columns(capacity) for _ in range(batches - 1)]
+        self._full = []
+        self._active = _Columns(capacity)
+        self._lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._thread = None
+        self._running = False
+        self._connection = None
+        self._file = None
+        # time.monotonic() -> wall clock, fixed at start so rows stay ordered
+        self._wall_offset = time.time() - time.monotonic()
+
+        self.reads_recorded = 0
+        self.reads_dropped = 0
+        self.rows_written = 0
+
+    def record(self, tag) -> None:
+        self.record_many((tag,))
+
+    def record_many(self, tags) -> None:
+        with self._lock:
+            for tag in tags:
+                columns = self._active
+                if columns.size == self.capacity:
+                    if not self._free:
+                        self.reads_dropped += 1
+                        continue
+                    self._full.append(columns)
+                    columns = self._active = self._free.pop()
+                    self._flush_event.set()
+                i = columns.size
+                columns.epc[i] = tag.epc
+                columns.lane[i] = tag.lane
+                columns.rssi[i] = tag.rssi
+                columns.reader_timestamp[i] = tag.timestamp
+                columns.host_time[i] = tag.received_at
+                columns.size = i + 1
+                self.reads_recorded += 1
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the writer thread after flushing everything recorded so far"""
+        self._running = False
+        self._flush_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _take_batches(self, include_active: bool) -> List[_Columns]:
+        with self._lock:
+            batches, self._full = self._full, []
+            if include_active and self._active.size and self._free:
+                batches.append(self._active)
+                self._active = self._free.pop()
+        return batches
+
+    def _release(self, batches: List[_Columns]) -> None:
+        with self._lock:
+            for columns in batches:
+                columns.size = 0
+                self._free.append(columns)
+
+    def _flush_loop(self) -> None:
+        writer = self._open_writer()
+        try:
+            while True:
+                self._flush_event.wait(self.flush_interval)
+                self._flush_event.clear()
+                running = self._running
+                batches = self._take_batches(include_active=True)
+                if not running:
+                    # Final flush, the active batch may not have had a free swap
+                    with self._lock:
+                        if self._active.size:
+                            batches.append(self._active)
+                            self._active = _Columns(self.capacity)
+                if batches:
+                    writer(batches)
+                    self._release(batches)
+                if not running:
+                    break
+        finally:
+            self._close_writer()
+
+    def _open_writer(self):
+        if self.path.endswith(('.db', '.sqlite')):
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS raw_reads ("
+                "epc TEXT, rssi INTEGER, reader_timestamp INTEGER, "
+                "host_time REAL, wall_time REAL, lane TEXT)")
+            return self._write_sqlite
+        new_file = not os.path.exists(self.path)
+        self._file = open(self.path, 'a', newline='')
+        self._csv = csv.writer(self._file)
+        if new_file:
+            self._csv.writerow(self.COLUMNS)
+        return self._write_csv
+
+    def _close_writer(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write_sqlite(self, batches: List[_Columns]) -> None:
+        with self._connection:
+            for columns in batches:
+                self._connection.executemany(
+                    "INSERT INTO raw_reads VALUES (?, ?, ?, ?, ?, ?)", columns.rows(self._wall_offset))
+                self.rows_written += columns.size
+
+    def _write_csv(self, batches: List[_Columns]) -> None:
+        for columns in batches:
+            self._csv.writerows(columns.rows(self._wall_offset))
+            self.rows_written += columns.size
+        self._file.flush()
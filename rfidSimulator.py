@@ -0,0 +1,192 @@
+import os
+import random
+import select
+import threading
+import time
+import tty
+from typing import Optional, List, Tuple
+
+import rfid
+
+
+class UHFSimulator:
+    """Stand-in for the UHF reader that writes RF-framed tag notifications
+
+    Writes either to a pty (open_pty(), the reader opens the returned path) or to a
+    pyserial port object such as serial.serial_for_url('loop://'). The timestamp TLV
+    carries a sequence number so write-to-callback latency can be measured. On a pty
+    it also answers reader commands like the real device.
+    """
+
+    def __init__(self, epcs: Optional[List[bytes]] = None, rssi_range: Tuple[int, int] = (40, 90),
+                 rate: float = 100, split_ratio: float = 0.0, corrupt_ratio: float = 0.0,
+                 junk_ratio: float = 0.0, seed: Optional[int] = None):
+        self.random = random.Random(seed)
+        # 12 byte EPCs, like the tags in the vehicle table
+        self.epcs = epcs or [self.random.randbytes(12) for _ in range(8)]
+        self.rssi_range = rssi_range
+        self.rate = rate
+        self.split_ratio = split_ratio
+        self.corrupt_ratio = corrupt_ratio
+        self.junk_ratio = junk_ratio
+
+        self._master_fd = None
+        self._slave_fd = None
+        self._port = None
+        self._thread = None
+        self._running = False
+        self._write_lock = threading.RLock()
+        self.parameters = {rfid.PARAM_POWER: (3000).to_bytes(2, 'big')}
+        self.commands_received = []  # Frame codes, in arrival order
+
+        self.frames_sent = 0
+        self.frames_corrupted = 0
+        self.junk_bytes = 0
+        self.sent_at = {}  # sequence -> time.monotonic() of the write
+
+    def open_pty(self) -> str:
+        """Create a pty pair and return the path the reader should open"""
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._slave_fd)
+        threading.Thread(target=self._command_loop, args=(self._master_fd,), daemon=True).start()
+        return os.ttyname(self._slave_fd)
+
+    def attach(self, port) -> None:
+        """Write to an existing pyserial port instead of a pty"""
+        self._port = port
+
+    def _write(self, data: bytes) -> None:
+        with self._write_lock:
+            if self._port is not None:
+                self._port.write(data)
+            else:
+                os.write(self._master_fd, data)
+
+    def _command_loop(self, fd: int) -> None:
+        buffer = bytearray()
+        while True:
+            try:
+                ready, _, _ = select.select([fd], [], [], 0.1)
+                if ready:
+                    buffer += os.read(fd, 4096)
+            except (OSError, ValueError):
+                return  # pty closed
+            while True:
+                start = buffer.find(rfid.FRAME_HEADER)
+                if start < 0:
+                    buffer.clear()
+                    break
+                del buffer[:start]
+                if len(buffer) < rfid.FRAME_HEADER_LENGTH:
+                    break
+                frame_end = rfid.FRAME_HEADER_LENGTH + int.from_bytes(buffer[6:8], 'big') + 1
+                if len(buffer) < frame_end:
+                    break
+                frame = bytes(buffer[:frame_end])
+                del buffer[:frame_end]
+                self.handle_command(frame)
+
+    def handle_command(self, frame: bytes) -> None:
+        """Answer one command frame with a success response"""
+        frame_code = frame[5]
+        parameters = frame[rfid.FRAME_HEADER_LENGTH:-1]
+        self.commands_received.append(frame_code)
+        if frame_code == 0x22:  # Single inventory round, answered with one notification per tag
+            for epc in self.epcs:
+                self.send_tag(epc)
+            return
+        response = bytes([0x07, 1, 0x00])  # Status: success
+        if frame_code == 0x40:  # Version 4.0.1, device type 5
+            response += bytes([0x20, 3, 4, 0, 1, 0x21, 1, 5])
+        elif frame_code == 0x48:  # Set single parameter: 26 len type value
+            self.parameters[parameters[2]] = parameters[3:]
+        elif frame_code == 0x49:  # Query single parameter: 26 01 type
+            param_type = parameters[2]
+            value = self.parameters.get(param_type)
+            if value is None:
+                response = bytes([0x07, 1, 0x14])  # Parameter unsupported
+            else:
+                response += bytes([0x26, len(value) + 1, param_type]) + value
+        self._write(rfid.build_frame(0x01, frame_code, response))
+
+    def tag_frame(self, epc: bytes, rssi: int, sequence: int) -> bytes:
+        # Single Tag TLV wrapping the EPC, RSSI and time TLVs, as in the protocol doc
+        tlvs = bytes([0x01, len(epc)]) + epc + \
+               bytes([0x05, 1, rssi]) + \
+               bytes([0x06, 4]) + sequence.to_bytes(4, 'big')
+        return rfid.build_frame(0x02, 0x80, bytes([0x50, len(tlvs)]) + tlvs)
+
+    def send_tag(self, epc: Optional[bytes] = None, rssi: Optional[int] = None) -> None:
+        """Write one tag notification, possibly corrupted, split or preceded by junk"""
+        sequence = self.frames_sent
+        epc = epc or self.random.choice(self.epcs)
+        rssi = rssi if rssi is not None else self.random.randint(*self.rssi_range)
+        frame = self.tag_frame(epc, rssi, sequence)
+
+        if self.random.random() < self.junk_ratio:
+            junk = self.random.randbytes(self.random.randint(1, 16))
+            self.junk_bytes += len(junk)
+            self._write(junk)
+        if self.random.random() < self.corrupt_ratio:
+            frame = frame[:-1] + bytes([frame[-1] ^ 0xFF])
+            self.frames_corrupted += 1
+
+        with self._write_lock:
+            self.sent_at[sequence] = time.monotonic()
+            if self.random.random() < self.split_ratio:
+                cut = self.random.randint(1, len(frame) - 1)
+                self._write(frame[:cut])
+                self._write(frame[cut:])
+            else:
+                self._write(frame)
+        self.frames_sent += 1
+
+    def run(self, duration: Optional[float] = None, count: Optional[int] = None) -> None:
+        """Send tags at `rate` per second until duration/count is reached or stop() is called"""
+        self._running = True
+        interval = 1.0 / self.rate
+        start = time.monotonic()
+        next_send = start
+        sent = 0
+        while self._running:
+            now = time.monotonic()
+            if duration is not None and now - start >= duration:
+                break
+            if count is not None and sent >= count:
+                break
+            if now < next_send:
+                time.sleep(next_send - now)
+                continue
+            self.send_tag()
+            sent += 1
+            next_send += interval
+        self._running = False
+
+    def start(self, duration: Optional[float] = None, count: Optional[int] = None) -> None:
+        self._thread = threading.Thread(target=self.run, args=(duration, count), daemon=True)
+        self._thread.start()
+
+    def join(self) -> None:
+        if self._thread is not None:
+            self._thread.join()
+
+    def stop(self) -> None:
+        self._running = False
+        self.join()
+
+    def close(self) -> None:
+        self.stop()
+        for fd in (self._master_fd, self._slave_fd):
+            if fd is not None:
+                os.close(fd)
+        self._master_fd = self._slave_fd = None
+
+
+if __name__ == "__main__":
+    # Serve a simulated reader on a pty until interrupted
+    simulator = UHFSimulator(rate=20, split_ratio=0.1, corrupt_ratio=0.02, junk_ratio=0.02)
+    print(f"Simulated UHF reader on {simulator.open_pty()}")
+    try:
+        simulator.run()
+    except KeyboardInterrupt:
+        simulator.close()
@@ -0,0 +1,24 @@
+import io
+
+from flask import Request
+
+# Largest upload accepted, a few full resolution views with room to spare
+MAX_UPLOAD_BYTES = 16 * 1024 * 1024
+
+
+class InMemoryRequest(Request):
+    """Flask request that keeps uploaded files in memory
+
+    Werkzeug writes file parts of requests over 500 KB to a temporary file,
+    and full resolution frames are about that size. Set as app.request_class,
+    together with MAX_CONTENT_LENGTH to bound the memory a request can take.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
+
+def keep_uploads_in_memory(app):
+    """Parse the app's uploads in memory, up to MAX_UPLOAD_BYTES per request"""
+    app.request_class = InMemoryRequest
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
@@ -21,6 +21,8 @@ plateDetected = False
 rfid_done = False
 yolo_done = False
 rfidReader = rfid.RFIDReader()
+RFID_TIMEOUT = 5  # Seconds to wait for a tag after the vehicle is detected
+RFID_LOOKBACK = 2  # Seconds before detection a tag read still counts
 
 
 
@@ -219,20 +221,11 @@ def detectPlateNumber(filepath):
 
 def handle_rfid():
     global rfid_done
-    max_attempts = 5
-    attempt = 0
-    rfid_result = None
-
-    while attempt < max_attempts:
-        rfid_result = rfidReader.read_response()
-        if rfid_result:
-            print(f"RFID found: {rfid_result}")
-            rfid_done = True
-            return
-        else:
-            print(f"RFID read failed, retrying... ({attempt + 1}/{max_attempts})")
-        attempt += 1
-        time.sleep(1)  # Add a small delay between retries
+    tag = rfidReader.wait_for_tag(timeout=RFID_TIMEOUT, since=time.monotonic() - RFID_LOOKBACK)
+    if tag:
+        print(f"RFID found: {tag.tag_number}")
+        rfid_done = True
+        return
 
     print("RFID not found.")
     rfid_done = False
@@ -253,6 +246,7 @@ def main():
     try:
         rfidReader.on_tag_read(rfidHandler.handle_tag)
         rfidReader.start_inventory()
+        rfidReader.start_reading()
 
         while True:
             # Read the sensor status